@@ -0,0 +1,231 @@
+'''Host driven animations and the render thread that plays them.
+
+Game callbacks only queue animations with AnimationEngine.play(), the engine's
+render thread owns all timing. Animations are layered by priority on top of
+each other. The idle effect is whatever WLED runs on its own, it shows through
+whenever no host animation is active because the engine then releases realtime
+mode on the device.
+'''
+import logging
+import time
+from threading import Condition, Thread
+
+import metrics
+from pixels import PixelBuffer
+from scheduler import FrameScheduler
+
+log = logging.getLogger(__name__)
+
+RENDER_SECONDS = metrics.histogram("hutch_render_seconds", "Time to encode and send a frame to the device.")
+FRAMES = metrics.counter("hutch_frames_sent_total", "Frames handed to the device by the render thread.")
+
+BLACK = (0, 0, 0)
+
+
+class Animation():
+    '''Base class for host driven animations.
+
+    Only one animation per key can be active, a newly played animation
+    replaces the active one with the same key unless that one has a higher
+    priority. Higher priorities are composited on top of lower ones.
+    '''
+    key = None
+    priority = 0
+
+    def __init__(self, duration):
+        self.duration = duration
+        self.start = None
+
+    def begin(self, now):
+        self.start = now
+
+    def done(self, now):
+        return now - self.start >= self.duration
+
+    def color(self, elapsed):
+        '''Returns the ([r, g, b], alpha) of the animation at elapsed seconds.'''
+        raise NotImplementedError
+
+    def render(self, now, frame):
+        '''Draws the animation at time now over frame, a PixelBuffer.'''
+        color, alpha = self.color(now - self.start)
+        frame.blend_color(color, alpha)
+
+
+class Blink(Animation):
+    '''Alternates between off and color a given number of times.'''
+    key = "blink"
+    priority = 10
+
+    def __init__(self, times, speed, color):
+        self.period = 10 / speed
+        self.blink_color = list(color)
+        super().__init__(2 * times * self.period)
+
+    def color(self, elapsed):
+        if int(elapsed / self.period) % 2:
+            return self.blink_color, 1.0
+        return list(BLACK), 1.0
+
+
+class Flashbang(Animation):
+    '''White at the given intensity fading linearly to off over duration.'''
+    key = "flash"
+    priority = 20
+
+    def __init__(self, start_intensity, duration=.5):
+        super().__init__(duration)
+        self.start_intensity = start_intensity
+
+    def color(self, elapsed):
+        value = int(self.start_intensity * max(0.0, 1 - elapsed / self.duration))
+        return [value, value, value], 1.0
+
+
+class AnimationEngine():
+    '''Plays animations on a device from one long-lived render thread.
+
+    Frames are composed on the deadlines of a FrameScheduler, animations
+    draw themselves from the monotonic time the frame is composed at, not
+    from a frame count, so skipped frames do not slow them down. Frames are
+    only sent when they differ from the last one sent. While an animation
+    holds a frame, it is resent every device.keepalive seconds so the device
+    does not fall back out of realtime mode.
+    '''
+    def __init__(self, device, framerate=1/30, name=None):
+        '''name labels the frame rate and jitter gauges, the device's name or host by default.'''
+        self._device = device
+        self.scheduler = FrameScheduler(1 / framerate, name=name or getattr(device, "name", None) or getattr(device, "host", None))
+        self._active = {}
+        self._condition = Condition()
+        self._running = False
+        self._live = False
+        self._woken = False
+        self._thread = None
+        self.version = 0
+        self.sent = 0
+        self.skipped = 0
+
+    @property
+    def active(self):
+        with self._condition:
+            return list(self._active.values())
+
+    def start(self):
+        if self._thread is None:
+            self._running = True
+            self._thread = Thread(target=self._run, name="render", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        with self._condition:
+            self._running = False
+            self._condition.notify()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.scheduler.close()
+
+    def play(self, animation):
+        '''Queues an animation, returns False if a higher priority one holds its key.'''
+        with self._condition:
+            current = self._active.get(animation.key)
+            if current is not None and current.priority > animation.priority:
+                return False
+            animation.begin(time.monotonic())
+            self._active[animation.key] = animation
+            self._woken = True
+            self._condition.notify()
+        return True
+
+    def cancel(self, key):
+        with self._condition:
+            self._active.pop(key, None)
+
+    def expire(self, now):
+        '''Drops finished animations, returns the rest by priority.'''
+        with self._condition:
+            for key, animation in list(self._active.items()):
+                if animation.done(now):
+                    del self._active[key]
+            return sorted(self._active.values(), key=lambda a: a.priority)
+
+    def drop(self, animation):
+        with self._condition:
+            if self._active.get(animation.key) is animation:
+                del self._active[animation.key]
+
+    def compose(self, now):
+        '''Composites the active animations, returns None when nothing is left to draw.'''
+        layers = self.expire(now)
+        if not layers:
+            return None
+        # A new buffer every frame, a device group may still be sending the last one.
+        frame = PixelBuffer(self._device.led_count)
+        for animation in layers:
+            try:
+                animation.render(now, frame)
+            except Exception:
+                # A broken animation, e.g. from a bad rule color, must not end the render thread.
+                log.exception(f"Could not render {type(animation).__name__}, dropping it.")
+                self.drop(animation)
+        return frame
+
+    def _run(self):
+        last_frame = None
+        last_sent = 0
+        while True:
+            with self._condition:
+                if not self._active and not self._live:
+                    while self._running and not self._active:
+                        self._condition.wait()
+                    self._woken = False
+                    self.scheduler.reset(time.monotonic())
+                if not self._running:
+                    break
+            now = time.monotonic()
+            frame = None
+            if not self._device.led_count:
+                # Nothing can be drawn before the device's info is known, animations wait or expire.
+                self.expire(now)
+            else:
+                try:
+                    frame = self.compose(now)
+                except Exception:
+                    log.exception("Could not compose frame.")
+                    self.skipped += 1
+                else:
+                    if frame is None:
+                        if self._live:
+                            self._live = False
+                            self._device.release()
+                        last_frame = None
+                        continue
+            if frame is not None:
+                changed = frame != last_frame
+                keepalive = self._device.keepalive
+                if changed or (keepalive is not None and now - last_sent >= keepalive):
+                    self._live = True
+                    start = time.perf_counter()
+                    try:
+                        self._device.leds = frame
+                        self._device.render()
+                    except Exception:
+                        log.exception("Could not render frame.")
+                    RENDER_SECONDS.observe(time.perf_counter() - start)
+                    FRAMES.inc()
+                    if changed:
+                        self.version += 1
+                    last_frame = frame
+                    last_sent = now
+                    self.sent += 1
+                else:
+                    self.skipped += 1
+            self.scheduler.tick(now)
+            with self._condition:
+                if not self._woken:
+                    self._condition.wait(self.scheduler.timeout(time.monotonic()))
+                if self._woken:
+                    # play() wakes the thread early so a new animation goes out right away.
+                    self._woken = False
+                    self.scheduler.reset(time.monotonic())
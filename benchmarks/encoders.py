@@ -0,0 +1,64 @@
+'''Microbenchmark of the legacy per-LED packet builder against the reusable encoders.
+
+Run from the repository root with: python -m benchmarks.encoders
+'''
+import timeit
+
+from protocols import get_encoder
+
+LED_COUNTS = (8, 300, 1500)
+# Encoder name to the name the legacy builder used for the same protocol.
+PROTOCOLS = {"drgb": "warls", "e131": "e131", "adalight": "adalight"}
+# The legacy E1.31 header was not a valid sACN packet, its output is not comparable.
+SAME_OUTPUT = ("drgb", "adalight")
+
+
+def legacy_make_packet(data, protocol):
+    '''The packet builder WLEDDevice.make_packet used before the encoders existed.'''
+    payload = bytearray()
+    for color in data:
+        payload += bytearray(color)
+    if protocol == "adalight":
+        checksum = (len(data) >> 8) ^ (len(data) & 0xff) ^ 0x55
+        header = b'Ada' + len(data).to_bytes(2, 'big') + checksum.to_bytes(1, 'big')
+    elif protocol == "e131":
+        header = bytearray([
+            0x41, 0x53, 0x43, 0x2d, 0x45, 0x31, 0x2e, 0x31,
+            0x00, 0x00, 0x00, 0x01,
+            0x00,
+            0x00,
+            0x00, 0x00
+        ])
+        length = len(data) * 3
+        header[14] = (length >> 8) & 0xff
+        header[15] = length & 0xff
+    elif protocol == "warls":
+        header = bytearray([0x02, 0x01])
+    return header + payload
+
+
+def frame(led_count):
+    return [[i & 0xff, (i * 7) & 0xff, (i * 13) & 0xff] for i in range(led_count)]
+
+
+def bench(func, number):
+    return min(timeit.repeat(func, number=number, repeat=5)) / number
+
+
+def main():
+    print(f"{'protocol':<10}{'leds':>6}{'legacy us':>12}{'encoder us':>12}{'speedup':>9}")
+    for protocol, legacy_protocol in PROTOCOLS.items():
+        for led_count in LED_COUNTS:
+            data = frame(led_count)
+            # A 1500 led strip does not fit in one DRGB datagram, DNRGB chunks it.
+            encoder = get_encoder("dnrgb" if protocol == "drgb" and led_count > 490 else protocol, led_count)
+            if protocol in SAME_OUTPUT and len(encoder.packets) == 1:
+                assert b''.join(encoder.encode(data)) == bytes(legacy_make_packet(data, legacy_protocol))
+            number = max(10, 30000 // led_count)
+            legacy = bench(lambda: legacy_make_packet(data, legacy_protocol), number)
+            new = bench(lambda: encoder.encode(data), number)
+            print(f"{protocol:<10}{led_count:>6}{legacy * 1e6:>12.2f}{new * 1e6:>12.2f}{legacy / new:>8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+'''Per-request CPU of full flattening against selective path extraction.
+
+Run from the repository root with: python -m benchmarks.extract
+'''
+import json
+import time
+
+from benchmarks.payloads import encode, full_payload, with_previously
+from gamestate import GameState, flatten_dict
+from server import json_loads
+
+PATHS = ("player.state.flashed", "player.state.burning", "player.state.round_killhs")
+
+
+def flatten_all(body, state, loads=json_loads):
+    '''The previous path: flatten every key, then diff everything.'''
+    payload = loads(body)
+    del payload["auth"]
+    flat = flatten_dict(payload)
+    changes = {path: value for path, value in flat.items() if state.get(path) != value}
+    state.update(flat)
+    return changes
+
+
+def extract_subscribed(body, gamestate):
+    payload = json_loads(body)
+    del payload["auth"]
+    return gamestate.update(payload)
+
+
+def cpu_per_call(func, bodies, *args, repeat=5):
+    best = None
+    for _ in range(repeat):
+        start = time.process_time()
+        for body in bodies:
+            func(body, *args)
+        elapsed = (time.process_time() - start) / len(bodies)
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    bodies = []
+    for i in range(2000):
+        payload = full_payload(flashed=(i * 37) % 256, round_kills=i % 5)
+        if i % 10 == 0:
+            payload = with_previously(payload, {"player.state.flashed": 0})
+        bodies.append(encode(payload))
+
+    gamestate = GameState()
+    for path in PATHS:
+        gamestate.subscribe(path, lambda path, old, new: None)
+
+    print(f"payload size: {len(bodies[0])} bytes, {len(flatten_dict(json.loads(bodies[0])))} flattened paths")
+    print(f"json backend: {json_loads.__module__}")
+    stdlib = cpu_per_call(flatten_all, bodies, {}, json.loads)
+    full = cpu_per_call(flatten_all, bodies, {})
+    selective = cpu_per_call(extract_subscribed, bodies, gamestate)
+    # Both extraction figures use the same decoder, the decoder's own gain is reported apart.
+    print(f"flatten_dict + full diff: {full * 1e6:8.1f} us/request")
+    print(f"selective extraction:     {selective * 1e6:8.1f} us/request")
+    print(f"saved by extraction:      {(full - selective) * 1e6:8.1f} us/request ({full / selective:.1f}x)")
+    print(f"saved by json backend:    {(stdlib - full) * 1e6:8.1f} us/request (flatten_dict with json: {stdlib * 1e6:.1f} us)")
+
+
+if __name__ == "__main__":
+    main()
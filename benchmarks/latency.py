@@ -0,0 +1,220 @@
+'''End-to-end latency from a GSI POST to the first LED datagram or state request.
+
+Starts a GSIServer feeding the real WLEDNetworkDevice.handle_csgo_payload
+pipeline, pointed at a local WLED stand-in, then fires scripted payloads and
+sustained POST rates. Results are printed as JSON, or written to --output, so
+runs can be compared across commits.
+
+Run from the repository root with: python -m benchmarks.latency
+'''
+import argparse
+import contextlib
+import http.client
+import io
+import json
+import os
+import platform
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from threading import Condition
+
+from benchmarks.payloads import encode, full_payload
+from benchmarks.sink import WLEDSink
+from server import GSIServer
+from wled_device import WLEDNetworkDevice
+
+# name: (reset payload, trigger payload, sink records to watch, animation keys to cancel)
+SCENARIOS = {
+    "flash": (full_payload(flashed=0), full_payload(flashed=255), "datagrams", ("flash",)),
+    "burn": (full_payload(burning=0), full_payload(burning=255), "posts", ()),
+    "headshot": (full_payload(round_killhs=0), full_payload(round_killhs=1), "datagrams", ("blink",)),
+}
+RATES = (50, 200, 1000, 0)
+
+
+class Pipeline():
+    '''The device callback, counting dispatched payloads.
+
+    The mailbox merges payloads that pile up, wait_for() counts those as
+    handled once the payload they were merged into is dispatched.
+    '''
+    def __init__(self, device):
+        self.device = device
+        self.server = None
+        self.dispatched = 0
+        self._condition = Condition()
+
+    @property
+    def coalesced(self):
+        if self.server is None:
+            return 0
+        return sum(stats["coalesced"] for stats in self.server.mailbox_stats().values())
+
+    @property
+    def idle(self):
+        return self.server is None or all(stats["depth"] == 0 for stats in self.server.mailbox_stats().values())
+
+    def __call__(self, payload):
+        self.device.handle_csgo_payload(payload)
+        with self._condition:
+            self.dispatched += 1
+            self._condition.notify_all()
+
+    def wait_for(self, count, timeout=10):
+        with self._condition:
+            return self._condition.wait_for(lambda: self.dispatched + self.coalesced >= count and self.idle, timeout)
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def summarize(samples):
+    if not samples:
+        return {"n": 0}
+    ordered = sorted(samples)
+    # Inclusive, so small samples are not extrapolated past their max.
+    quantiles = statistics.quantiles(ordered, n=100, method="inclusive") if len(ordered) > 1 else ordered * 99
+    return {
+        "n": len(ordered),
+        "mean_ms": statistics.fmean(ordered) * 1e3,
+        "p50_ms": quantiles[49] * 1e3,
+        "p90_ms": quantiles[89] * 1e3,
+        "p99_ms": quantiles[98] * 1e3,
+        "max_ms": ordered[-1] * 1e3,
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Client():
+    '''A keep-alive GSI client, like the game's.'''
+    def __init__(self, port):
+        self._connection = http.client.HTTPConnection("127.0.0.1", port)
+        self.posted = 0
+
+    def post(self, body):
+        self._connection.request("POST", "/", body, {"Content-Type": "application/json"})
+        self._connection.getresponse().read()
+        self.posted += 1
+
+
+def measure_latency(sink, device, pipeline, client, trials):
+    results = {}
+    for name, (reset, trigger, records, keys) in SCENARIOS.items():
+        reset, trigger = encode(reset), encode(trigger)
+        samples = []
+        for _ in range(trials):
+            client.post(reset)
+            pipeline.wait_for(client.posted)
+            for key in keys:
+                device.engine.cancel(key)
+            # Let the release and any state requests of the reset settle.
+            time.sleep(.1)
+            start = time.perf_counter()
+            client.post(trigger)
+            arrived = sink.wait_for(getattr(sink, records), start)
+            if arrived is not None:
+                samples.append(arrived - start)
+        results[name] = summarize(samples)
+        results[name]["missed"] = trials - len(samples)
+    for key in ("flash", "blink"):
+        device.engine.cancel(key)
+    return results
+
+
+def measure_throughput(pipeline, client, duration):
+    results = []
+    for rate in RATES:
+        responses = []
+        coalesced = pipeline.coalesced
+        start = time.perf_counter()
+        sent = 0
+        while time.perf_counter() - start < duration:
+            if rate:
+                delay = start + sent / rate - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            # Only the timestamp changes, this measures ingest and dispatch, not animations.
+            body = encode(dict(full_payload(), provider=dict(full_payload()["provider"], timestamp=sent)))
+            posted_at = time.perf_counter()
+            client.post(body)
+            responses.append(time.perf_counter() - posted_at)
+            sent += 1
+        elapsed = time.perf_counter() - start
+        pipeline.wait_for(client.posted, timeout=30)
+        drained = time.perf_counter() - start
+        results.append({
+            "target_rate": rate or "max",
+            "sent": sent,
+            "coalesced": pipeline.coalesced - coalesced,
+            "achieved_rate": sent / elapsed,
+            "drain_s": drained - elapsed,
+            "response": summarize(responses),
+        })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--trials", type=int, default=50)
+    parser.add_argument("--duration", type=float, default=2, help="seconds per throughput rate")
+    parser.add_argument("--leds", type=int, default=300)
+    parser.add_argument("--output", help="write the JSON results to this file instead of stdout")
+    args = parser.parse_args()
+
+    # Devices save csgo_config.toml to the working directory, keep it out of the checkout.
+    os.chdir(tempfile.mkdtemp(prefix="hutch-bench-"))
+    sink = WLEDSink(args.leds).start()
+    port = free_port()
+    # The device prints every payload, keep that out of the results.
+    with contextlib.redirect_stdout(io.StringIO()):
+        device = WLEDNetworkDevice({}, host=sink.host)
+        while device.engine.active:
+            time.sleep(.05)
+        pipeline = Pipeline(device)
+        server = GSIServer(("127.0.0.1", port), "MYTOKENHERE", pipeline)
+        server.start_server()
+        pipeline.server = server
+        client = Client(port)
+        try:
+            latency = measure_latency(sink, device, pipeline, client, args.trials)
+            throughput = measure_throughput(pipeline, client, args.duration)
+        finally:
+            server.shutdown()
+            device.close()
+            sink.stop()
+
+    results = {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "leds": args.leds,
+        "protocol": device.protocol,
+        "latency": latency,
+        "throughput": throughput,
+    }
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(results, output, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == "__main__":
+    main()
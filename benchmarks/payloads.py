@@ -0,0 +1,83 @@
+'''Realistic GSI payloads with every data section of gamestate_integration_hutch.cfg enabled.'''
+import copy
+import json
+
+TOKEN = "MYTOKENHERE"
+
+
+def full_payload(flashed=0, burning=0, round_killhs=0, round_kills=0):
+    weapons = {}
+    for i, (name, kind, clip, reserve) in enumerate([
+        ("weapon_knife_t", "Knife", None, None),
+        ("weapon_glock", "Pistol", 20, 120),
+        ("weapon_ak47", "Rifle", 30, 90),
+        ("weapon_flashbang", "Grenade", None, None),
+        ("weapon_smokegrenade", "Grenade", None, None),
+    ]):
+        weapon = {"name": name, "paintkit": "default", "type": kind, "state": "holstered"}
+        if clip is not None:
+            weapon.update({"ammo_clip": clip, "ammo_clip_max": clip, "ammo_reserve": reserve})
+        weapons[f"weapon_{i}"] = weapon
+    weapons["weapon_2"]["state"] = "active"
+    payload = {
+        "provider": {
+            "name": "Counter-Strike: Global Offensive",
+            "appid": 730,
+            "version": 13857,
+            "steamid": "76561198000000000",
+            "timestamp": 1675000000,
+        },
+        "map": {
+            "mode": "competitive",
+            "name": "de_mirage",
+            "phase": "live",
+            "round": 14,
+            "team_ct": {"score": 8, "consecutive_round_losses": 0, "timeouts_remaining": 1, "matches_won_this_series": 0},
+            "team_t": {"score": 6, "consecutive_round_losses": 1, "timeouts_remaining": 1, "matches_won_this_series": 0},
+            "num_matches_to_win_series": 0,
+            "current_spectators": 0,
+            "souvenirs_total": 0,
+            "round_wins": {str(i): ("ct_win_elimination" if i % 2 else "t_win_bomb") for i in range(1, 15)},
+        },
+        "round": {"phase": "live"},
+        "player": {
+            "steamid": "76561198000000000",
+            "name": "hutch",
+            "observer_slot": 1,
+            "team": "T",
+            "activity": "playing",
+            "state": {
+                "health": 100,
+                "armor": 100,
+                "helmet": True,
+                "flashed": flashed,
+                "smoked": 0,
+                "burning": burning,
+                "money": 2350,
+                "round_kills": round_kills,
+                "round_killhs": round_killhs,
+                "equip_value": 4700,
+            },
+            "weapons": weapons,
+            "match_stats": {"kills": 12, "assists": 3, "deaths": 9, "mvps": 2, "score": 31},
+        },
+        "auth": {"token": TOKEN},
+    }
+    return payload
+
+
+def with_previously(payload, previous):
+    '''Returns a copy of payload carrying a previously section for the given {path: old} values.'''
+    payload = copy.deepcopy(payload)
+    section = payload.setdefault("previously", {})
+    for path, value in previous.items():
+        node = section
+        keys = path.split('.')
+        for key in keys[:-1]:
+            node = node.setdefault(key, {})
+        node[keys[-1]] = value
+    return payload
+
+
+def encode(payload):
+    return json.dumps(payload).encode()
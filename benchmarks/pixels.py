@@ -0,0 +1,67 @@
+'''Per-frame cost of the pixel buffer kernels at 1k and 10k leds.
+
+Run from the repository root with: python -m benchmarks.pixels
+'''
+import timeit
+
+from pixels import PythonPixelBuffer, ease_in_out, numpy
+from protocols import DDPEncoder
+
+LED_COUNTS = (1000, 10000)
+
+
+def kernels(buffer_type, led_count):
+    frame = buffer_type(led_count).gradient([0, 0, 0], [255, 128, 0])
+    layer = buffer_type(led_count).fill([0, 0, 255])
+    factors = [i / led_count for i in range(led_count)]
+    encoder = DDPEncoder(led_count)
+    return {
+        "fill": lambda: frame.fill([255, 255, 255]),
+        "fade": lambda: frame.fade([255, 255, 255], [0, 0, 0], .4, ease_in_out),
+        "gradient": lambda: frame.gradient([255, 0, 0], [0, 0, 255]),
+        "blend_color": lambda: frame.blend_color([255, 153, 0], .5),
+        "blend": lambda: frame.blend(layer, .5),
+        "scale": lambda: frame.scale(.9),
+        "scale int": lambda: frame.scale(2),
+        "scale per pixel": lambda: frame.scale(factors),
+        "ddp encode": lambda: encoder.encode(frame),
+    }
+
+
+def list_kernels(led_count):
+    '''The list of [r, g, b] lists frames used before the pixel buffers.'''
+    encoder = DDPEncoder(led_count)
+    frame = [[255, 255, 255]] * led_count
+    return {
+        "fill": lambda: [[255, 255, 255]] * led_count,
+        "ddp encode": lambda: encoder.encode(frame),
+    }
+
+
+def bench(func):
+    number = 20
+    return min(timeit.repeat(func, number=number, repeat=5)) / number
+
+
+def main():
+    backends = {"list": None, "bytearray": PythonPixelBuffer}
+    if numpy is not None:
+        from pixels import NumpyPixelBuffer
+        backends["numpy"] = NumpyPixelBuffer
+    else:
+        print("NumPy is not installed, only the bytearray fallback is measured.")
+    for led_count in LED_COUNTS:
+        results = {}
+        for name, buffer_type in backends.items():
+            funcs = list_kernels(led_count) if buffer_type is None else kernels(buffer_type, led_count)
+            for kernel, func in funcs.items():
+                results.setdefault(kernel, {})[name] = bench(func)
+        print(f"\n{led_count} leds, us per frame")
+        print(f"{'kernel':<18}" + "".join(f"{name:>12}" for name in backends))
+        for kernel, timings in results.items():
+            row = "".join(f"{timings[name] * 1e6:>12.1f}" if name in timings else f"{'-':>12}" for name in backends)
+            print(f"{kernel:<18}{row}")
+
+
+if __name__ == "__main__":
+    main()
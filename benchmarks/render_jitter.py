@@ -0,0 +1,153 @@
+'''Frame jitter of the in-thread renderer and the render worker process, idle and under ingest load.
+
+A long Flashbang is played on a WLEDNetworkDevice pointed at a local WLED
+stand-in, so a changed frame is due on every tick. The datagrams are
+timestamped by a receiver in its own process, the GIL of the process under
+test does not delay them. Under load, client threads POST full payloads to a
+GSIServer feeding the device's handle_csgo_payload as fast as they can.
+
+Run from the repository root with: python -m benchmarks.render_jitter
+'''
+import argparse
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import platform
+import socket
+import statistics
+import sys
+import tempfile
+import time
+from threading import Event, Thread
+
+from animation import Flashbang
+from benchmarks.latency import Client, free_port, git_commit
+from benchmarks.payloads import TOKEN, encode, full_payload
+from benchmarks.sink import WLEDSink
+from server import GSIServer
+from transport import PORTS
+from wled_device import WLEDNetworkDevice
+
+MODES = ("thread", "process")
+
+
+def receive(port, connection):
+    '''Runs in its own process, sends back the arrival time of every datagram once asked to stop.'''
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(("127.0.0.1", port))
+    sock.settimeout(.05)
+    connection.send("ready")
+    stamps = []
+    while not connection.poll():
+        try:
+            sock.recv(65535)
+        except socket.timeout:
+            continue
+        stamps.append(time.perf_counter())
+    connection.recv()
+    sock.close()
+    connection.send(stamps)
+
+
+def load(port, stop):
+    client = Client(port)
+    sent = 0
+    while not stop.is_set():
+        client.post(encode(dict(full_payload(flashed=0), provider=dict(full_payload()["provider"], timestamp=sent))))
+        sent += 1
+    return sent
+
+
+def summarize(stamps, framerate):
+    intervals = [b - a for a, b in zip(stamps, stamps[1:])]
+    if not intervals:
+        return {"frames": len(stamps)}
+    deviations = sorted(abs(interval - framerate) for interval in intervals)
+    return {
+        "frames": len(stamps),
+        "fps": len(intervals) / (stamps[-1] - stamps[0]),
+        "interval_mean_ms": statistics.fmean(intervals) * 1e3,
+        "interval_stdev_ms": statistics.pstdev(intervals) * 1e3,
+        "deviation_p50_ms": deviations[len(deviations) // 2] * 1e3,
+        "deviation_p99_ms": deviations[min(len(deviations) - 1, int(len(deviations) * .99))] * 1e3,
+        "max_interval_ms": max(intervals) * 1e3,
+    }
+
+
+def measure(mode, loaded, sink, duration, clients):
+    context = multiprocessing.get_context("spawn")
+    parent, child = context.Pipe()
+    receiver = context.Process(target=receive, args=(PORTS["drgb"], child), daemon=True)
+    receiver.start()
+    parent.recv()
+    device = WLEDNetworkDevice({"render_process": mode == "process"}, host=sink.host)
+    device.ready.wait(10)
+    # Let the greeting blink finish.
+    time.sleep(1.5)
+    port = free_port()
+    server = GSIServer(("127.0.0.1", port), TOKEN, device.handle_csgo_payload)
+    server.start_server()
+    stop = Event()
+    threads = [Thread(target=load, args=(port, stop), daemon=True) for _ in range(clients if loaded else 0)]
+    for thread in threads:
+        thread.start()
+    time.sleep(.5)
+    started = time.perf_counter()
+    device.engine.play(Flashbang(255, duration + 1))
+    time.sleep(duration)
+    parent.send("stop")
+    # Both processes read the same monotonic clock, earlier datagrams belong to the greeting.
+    stamps = [stamp for stamp in parent.recv() if stamp >= started]
+    receiver.join()
+    stop.set()
+    for thread in threads:
+        thread.join()
+    server.shutdown()
+    device.close()
+    return summarize(stamps, device.framerate)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--duration", type=float, default=5, help="seconds of frames per run")
+    parser.add_argument("--clients", type=int, default=4, help="posting threads under load")
+    parser.add_argument("--leds", type=int, default=300)
+    parser.add_argument("--output", help="write the JSON results to this file instead of stdout")
+    args = parser.parse_args()
+
+    # Devices save csgo_config.toml to the working directory, keep it out of the checkout.
+    os.chdir(tempfile.mkdtemp(prefix="hutch-bench-"))
+    # Frames go to the receiver process, the sink only answers HTTP.
+    sink = WLEDSink(args.leds, udp_port=0).start()
+    results = {}
+    # The device prints every payload, keep that out of the results.
+    with contextlib.redirect_stdout(io.StringIO()):
+        try:
+            for mode in MODES:
+                results[mode] = {
+                    "idle": measure(mode, False, sink, args.duration, args.clients),
+                    "load": measure(mode, True, sink, args.duration, args.clients),
+                }
+        finally:
+            sink.stop()
+
+    results = {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "leds": args.leds,
+        "clients": args.clients,
+        "modes": results,
+    }
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(results, output, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+'''A local stand-in for a WLED controller: the JSON API over HTTP and a UDP frame sink.'''
+import json
+import socket
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Condition, Thread
+
+from transport import PORTS
+from util import effect, palette
+
+
+def names(table):
+    '''A WLED name list from a util table, the index of a name is its id.'''
+    result = ["RSVD"] * (max(table.values()) + 1)
+    for name, index in table.items():
+        result[index] = name
+    return result
+
+
+class WLEDSink():
+    '''Answers /json like a WLED device and records every state POST and UDP datagram.
+
+    Records are (time.perf_counter(), data) tuples. wait_for() blocks until a
+    record newer than a given time arrives. delay holds back every HTTP
+    answer, to stand in for a device on a slow network.
+    '''
+    def __init__(self, led_count=300, udp_port=PORTS["drgb"], host="127.0.0.1", delay=0):
+        self.led_count = led_count
+        self.delay = delay
+        self.state = {"on": True, "bri": 128, "live": False, "seg": [{"id": 0, "fx": 0, "sx": 128}]}
+        self.presets = {"0": {}}
+        self.posts = []
+        self.datagrams = []
+        self._condition = Condition()
+        sink = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def reply(self, document):
+                if sink.delay:
+                    time.sleep(sink.delay)
+                body = json.dumps(document).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                if self.path.startswith("/json/state"):
+                    self.reply(sink.state)
+                elif self.path.startswith("/json/effects"):
+                    self.reply(names(effect))
+                elif self.path.startswith("/json/palettes"):
+                    self.reply(names(palette))
+                elif self.path.startswith("/presets.json"):
+                    self.reply(sink.presets)
+                else:
+                    self.reply({"state": sink.state, "info": sink.info})
+
+            def do_POST(self):
+                patch = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                sink.record(sink.posts, patch)
+                if "psave" in patch:
+                    sink.presets[str(patch.pop("psave"))] = patch
+                    self.reply({"success": True})
+                    return
+                patch.pop("v", None)
+                sink.state.update({key: value for key, value in patch.items() if key != "seg"})
+                self.reply(sink.state)
+
+            def log_message(self, format, *args):
+                return
+
+        self._http = ThreadingHTTPServer((host, 0), Handler)
+        self._http.daemon_threads = True
+        self._udp = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._udp.bind((host, udp_port))
+        self.host = f"{host}:{self._http.server_address[1]}"
+        self.info = {
+            "ver": "0.14.0",
+            "name": "hutch sink",
+            "ip": host,
+            "uptime": 0,
+            "leds": {"count": led_count},
+        }
+
+    def record(self, records, data):
+        with self._condition:
+            records.append((time.perf_counter(), data))
+            self._condition.notify_all()
+
+    def start(self):
+        Thread(target=self._http.serve_forever, name="sink-http", daemon=True).start()
+        Thread(target=self._receive, name="sink-udp", daemon=True).start()
+        return self
+
+    def stop(self):
+        self._http.shutdown()
+        self._http.server_close()
+        self._udp.close()
+
+    def _receive(self):
+        while True:
+            try:
+                data = self._udp.recv(65535)
+            except OSError:
+                break
+            self.record(self.datagrams, data)
+
+    def wait_for(self, records, since, timeout=2):
+        '''Returns the time of the first record after since, or None on timeout.'''
+        def first():
+            result = None
+            for stamp, _ in reversed(records):
+                if stamp <= since:
+                    break
+                result = stamp
+            return result
+
+        with self._condition:
+            self._condition.wait_for(lambda: first() is not None, timeout)
+            return first()
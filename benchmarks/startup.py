@@ -0,0 +1,91 @@
+'''Startup time: importing hutchserver and bringing a device up cold or from the registry cache.
+
+The device is a local WLED stand-in that delays every HTTP answer by
+--delay seconds, like a controller on WiFi. Cold start asks it for its info
+before the device is usable, a cached start uses the registry entry the cold
+start left behind and validates in the background.
+
+Run from the repository root with: python -m benchmarks.startup
+'''
+import argparse
+import contextlib
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.sink import WLEDSink
+from wled_device import WLEDNetworkDevice
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+IMPORT_PROBE = '''
+import json, sys, time
+start = time.perf_counter()
+import hutchserver
+print(json.dumps({
+    "seconds": time.perf_counter() - start,
+    "zeroconf": "zeroconf" in sys.modules,
+    "serial": "serial" in sys.modules,
+}))
+'''
+
+
+def measure_import(runs):
+    results = []
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, "-c", IMPORT_PROBE], cwd=ROOT, capture_output=True, text=True, check=True)
+        results.append(json.loads(output.stdout.strip().splitlines()[-1]))
+    best = min(results, key=lambda result: result["seconds"])
+    return {
+        "min_ms": best["seconds"] * 1e3,
+        "zeroconf_imported": best["zeroconf"],
+        "serial_imported": best["serial"],
+    }
+
+
+def bring_up(config, sink):
+    '''Times a device from construction to usable, ready and its first datagram.'''
+    start = time.perf_counter()
+    device = WLEDNetworkDevice(config, host=sink.host)
+    constructed = time.perf_counter()
+    device.ready.wait(10)
+    ready = time.perf_counter()
+    first_datagram = sink.wait_for(sink.datagrams, start, timeout=10)
+    device.engine.stop()
+    device.close()
+    return {
+        "constructed_ms": (constructed - start) * 1e3,
+        "ready_ms": (ready - start) * 1e3,
+        "first_datagram_ms": (first_datagram - start) * 1e3 if first_datagram is not None else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--delay", type=float, default=.1, help="seconds the stand-in takes to answer HTTP")
+    parser.add_argument("--runs", type=int, default=5, help="import time is the best of this many runs")
+    parser.add_argument("--leds", type=int, default=300)
+    args = parser.parse_args()
+
+    results = {"import": measure_import(args.runs)}
+    # Devices save csgo_config.toml to the working directory, keep it out of the checkout.
+    os.chdir(tempfile.mkdtemp(prefix="hutch-bench-"))
+    sink = WLEDSink(args.leds, delay=args.delay).start()
+    config = {}
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            results["cold"] = bring_up(config, sink)
+            # The cold start filled the registry.
+            results["cached"] = bring_up(config, sink)
+    finally:
+        sink.stop()
+    json.dump(results, sys.stdout, indent=2)
+    print()
+
+
+if __name__ == "__main__":
+    main()
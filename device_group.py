@@ -0,0 +1,192 @@
+'''Drives several WLED devices as one.
+
+Every member gets an output thread with a one-frame slot. The group renders
+one frame per tick and hands it to every output together with a release time
+on the shared monotonic clock, so all strips show the frame at the same
+moment. An output that is still busy with an older frame simply has it
+replaced, a slow or offline controller only ever drops its own frames.
+'''
+import logging
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from threading import Condition, Thread
+
+from transport import DROPPED
+from wled_device import DeviceNotFound, GameReactions, WLEDNetworkDevice
+
+log = logging.getLogger(__name__)
+
+
+def fit_frame(frame, led_count):
+    '''Stretches or shrinks a frame to led_count leds.'''
+    if hasattr(frame, "resized"):
+        return frame.resized(led_count)
+    size = len(frame)
+    if size == led_count:
+        return frame
+    return [frame[i * size // led_count] for i in range(led_count)]
+
+
+class DeviceOutput(Thread):
+    '''Sends frames and JSON state to one member at its own pace.'''
+    def __init__(self, device, max_pending_json=32):
+        super().__init__(name=f"output-{device.host}", daemon=True)
+        self.device = device
+        self.dropped = 0
+        self._condition = Condition()
+        self._frame = None
+        self._release_at = 0
+        self._json = deque(maxlen=max_pending_json)
+        self._next_frame_at = 0
+        self._running = True
+
+    def submit_frame(self, frame, release_at):
+        with self._condition:
+            if self._frame is not None:
+                self.dropped += 1
+                DROPPED.inc()
+            self._frame = frame
+            self._release_at = release_at
+            self._condition.notify()
+
+    def submit_json(self, data):
+        with self._condition:
+            self._json.append((self.device.send_json, data))
+            self._condition.notify()
+
+    def submit_scene(self, name):
+        with self._condition:
+            self._json.append((self.device.send_scene, name))
+            self._condition.notify()
+
+    def stop(self):
+        with self._condition:
+            self._running = False
+            self._condition.notify()
+
+    def run(self):
+        while True:
+            with self._condition:
+                while self._running and self._frame is None and not self._json:
+                    self._condition.wait()
+                if not self._running:
+                    break
+                pending_json = list(self._json)
+                self._json.clear()
+                frame = self._frame
+                release_at = max(self._release_at, self._next_frame_at)
+                self._frame = None
+            for send, data in pending_json:
+                send(data)
+            if frame is None:
+                continue
+            delay = release_at - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            try:
+                self.device.leds = fit_frame(frame, self.device.led_count)
+                self.device.render()
+            except Exception:
+                log.exception(f"Could not render frame on {self.device.host}.")
+            # Paced from the release deadline, the time render() took does not add up.
+            self._next_frame_at = release_at + self.device.framerate
+
+
+class DeviceGroup(GameReactions):
+    '''A set of devices that play the same animations and game reactions.
+
+    Frames are rendered at the largest member's led count and fitted to each
+    member. lead is how far ahead of the shared clock a frame is released,
+    it should cover the time the slowest member needs to encode a frame.
+    '''
+    def __init__(self, config, devices, fps=None, lead=0.005):
+        self.devices = devices
+        self.lead = lead
+        self._leds = []
+        self._outputs = [DeviceOutput(device) for device in devices]
+        for output in self._outputs:
+            output.start()
+        self.setup_reactions(config, 1/(fps or config.get("fps", 30)))
+
+    @property
+    def name(self):
+        return "+".join(device.host for device in self.devices)
+
+    @property
+    def led_count(self):
+        return max(device.led_count for device in self.devices)
+
+    @property
+    def leds(self):
+        return self._leds
+
+    @leds.setter
+    def leds(self, data):
+        self._leds = data
+
+    @property
+    def keepalive(self):
+        intervals = [device.keepalive for device in self.devices if device.keepalive is not None]
+        return min(intervals) if intervals else None
+
+    @property
+    def dropped(self):
+        return {output.device.host: output.dropped for output in self._outputs}
+
+    def render(self):
+        release_at = time.monotonic() + self.lead
+        for output in self._outputs:
+            output.submit_frame(self._leds, release_at)
+
+    def release(self):
+        self.send_json({"live": False})
+
+    def send_json(self, data):
+        for output in self._outputs:
+            output.submit_json(data)
+
+    def send_scene(self, name):
+        # Every member has the scene compiled for its own firmware.
+        for output in self._outputs:
+            output.submit_scene(name)
+
+    def close(self):
+        self.engine.stop()
+        for output in self._outputs:
+            output.stop()
+        for device in self.devices:
+            device.close()
+
+
+def make_device_group(config, entries, fps=None):
+    '''Connects to every device entry concurrently and groups the reachable ones.
+
+    An entry is either a host name or a table with "host" and optionally
+    "protocol" and "fps", members without an fps use the "fps" key of the
+    config, like the group itself.
+    '''
+    def connect(entry):
+        if isinstance(entry, str):
+            entry = {"host": entry}
+        return WLEDNetworkDevice(
+            config,
+            host=entry["host"],
+            protocol=entry.get("protocol", "auto"),
+            fps=entry.get("fps"),
+            reactions=False,
+        )
+
+    with ThreadPoolExecutor(max_workers=len(entries) or 1) as executor:
+        devices = list(executor.map(connect, entries))
+    reachable = []
+    for device in devices:
+        if device.led_count:
+            reachable.append(device)
+        else:
+            log.warning(f"Leaving {device.host} out of the group, could not get its info.")
+    if not reachable:
+        raise DeviceNotFound
+    group = DeviceGroup(config, reachable, fps)
+    group.greet()
+    return group
@@ -0,0 +1,117 @@
+'''Zeroconf discovery of WLED devices and the registry of known devices.'''
+import json
+import logging
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from threading import Condition
+
+log = logging.getLogger(__name__)
+
+SERVICE_TYPE = "_wled._tcp.local."
+
+
+def probe(host, timeout=1):
+    '''Returns the /json document of a WLED device, or None if it does not answer.'''
+    try:
+        with urllib.request.urlopen(f"http://{host}/json", timeout=timeout) as response:
+            if response.getcode() == 200:
+                return json.loads(response.read())
+    except Exception:
+        log.debug(f"Couldn't get wled info from {host}")
+    return None
+
+
+def discover(timeout=5, first=False, count=None, probe_timeout=1):
+    '''Browses for WLED devices and probes them in parallel.
+
+    Returns {host: /json document} once the deadline passes, or as soon as
+    the first device answered (first=True) or count devices answered.
+    '''
+    # zeroconf is slow to import and only needed when the registry can't help.
+    from zeroconf import ServiceBrowser, ServiceStateChange, Zeroconf
+
+    found = {}
+    condition = Condition()
+    wanted = 1 if first else count
+    pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="wled-probe")
+
+    def resolve(zeroconf, service_type, name):
+        info = zeroconf.get_service_info(service_type, name, timeout=int(probe_timeout * 1000))
+        if info is None or not info.server:
+            return
+        host = info.server.rstrip('.')
+        wled = probe(host, probe_timeout)
+        if wled is not None:
+            with condition:
+                found[host] = wled
+                condition.notify()
+
+    def on_service_state_change(zeroconf, service_type, name, state_change):
+        if state_change is ServiceStateChange.Added:
+            pool.submit(resolve, zeroconf, service_type, name)
+
+    log.info(f"Scanning for wled devices for up to {timeout} seconds...")
+    zc = Zeroconf()
+    try:
+        ServiceBrowser(zc, SERVICE_TYPE, handlers=[on_service_state_change])
+        with condition:
+            condition.wait_for(lambda: wanted is not None and len(found) >= wanted, timeout)
+            result = dict(found)
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+        zc.close()
+    for host in result:
+        log.info(f"Found: {host}")
+    return result
+
+
+class DeviceRegistry():
+    '''Known devices stored in the "registry" table of the config.
+
+    Every entry remembers the device's name, ip, led count and firmware
+    version and when it was last seen. Entries older than ttl seconds are
+    ignored, so a stale registry falls back to a scan.
+    '''
+    def __init__(self, config, ttl=None):
+        self._config = config
+        self._entries = config.setdefault("registry", {})
+        self.ttl = ttl if ttl is not None else config.get("registry_ttl", 7 * 24 * 60 * 60)
+
+    def get(self, host):
+        entry = self._entries.get(host)
+        if entry is None or time.time() - entry.get("seen", 0) > self.ttl:
+            return None
+        return entry
+
+    def fresh(self):
+        '''Returns the hosts seen within the ttl, most recently seen first.'''
+        hosts = [host for host in self._entries if self.get(host) is not None]
+        return sorted(hosts, key=lambda host: self._entries[host]["seen"], reverse=True)
+
+    def update(self, host, wled):
+        info = wled.get("info", {})
+        self._entries[host] = {
+            "name": info.get("name", host),
+            "ip": info.get("ip", host),
+            "leds": info.get("leds", {}).get("count", 0),
+            "ver": info.get("ver", ""),
+            "seen": int(time.time()),
+        }
+        return self._entries[host]
+
+    def forget(self, host):
+        self._entries.pop(host, None)
+
+    def find_reachable(self, timeout=1):
+        '''Probes every fresh host in parallel, returns the first to answer in registry order.'''
+        hosts = self.fresh()
+        if not hosts:
+            return None, None
+        with ThreadPoolExecutor(max_workers=len(hosts)) as pool:
+            results = list(pool.map(lambda host: probe(host, timeout), hosts))
+        for host, wled in zip(hosts, results):
+            if wled is not None:
+                self.update(host, wled)
+                return host, wled
+        return None, None
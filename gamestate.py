@@ -0,0 +1,199 @@
+'''Incremental store of the flattened CS:GO gamestate.'''
+import logging
+import time
+from collections.abc import Mapping
+from threading import RLock
+
+import metrics
+
+log = logging.getLogger(__name__)
+
+EXTRACT_SECONDS = metrics.histogram("hutch_gamestate_extract_seconds", "Time to extract and diff the subscribed paths of a payload.")
+RULES_SECONDS = metrics.histogram("hutch_gamestate_rules_seconds", "Time the rule subscribers take to handle the changes of a payload.")
+
+# Sections the game sends alongside the state that only describe the current update.
+TRANSIENT = ("previously", "added")
+
+
+def flatten_dict(d):
+    result = {}
+    for key, value in d.items():
+        if isinstance(value, dict):
+            value = flatten_dict(value)
+            for subkey, subvalue in value.items():
+                result[key + '.' + subkey] = subvalue
+        else:
+            result[key] = value
+    return result
+
+
+def compile_extractor(paths):
+    '''Builds a function that pulls the given dotted paths out of a nested payload.
+
+    The paths are compiled into a tree of keys so one pass over the payload
+    only visits the branches that lead to a wanted path. A path whose value is
+    a dict yields every flattened path below it.
+    '''
+    tree = {}
+    for path in sorted(paths, key=len):
+        node = tree
+        keys = path.split('.')
+        for key in keys[:-1]:
+            child = node.setdefault(key, [None, {}])
+            if child[0] is not None:
+                # A shorter path already extracts this whole branch.
+                break
+            node = child[1]
+        else:
+            node[keys[-1]] = [path, {}]
+
+    def extract(node, data, result):
+        for key, (path, children) in node.items():
+            value = data.get(key)
+            if value is None:
+                continue
+            if path is not None:
+                if isinstance(value, dict):
+                    for subkey, subvalue in flatten_dict(value).items():
+                        result[path + '.' + subkey] = subvalue
+                else:
+                    result[path] = value
+            elif isinstance(value, dict):
+                extract(children, value, result)
+
+    def extractor(payload):
+        result = {}
+        extract(tree, payload, result)
+        return result
+    return extractor
+
+
+class LazyFlatView(Mapping):
+    '''Read-only flattened view of a nested payload, only flattened when first read.'''
+    def __init__(self, payload):
+        self._payload = payload
+        self._flat = None
+
+    @property
+    def flat(self):
+        if self._flat is None:
+            self._flat = flatten_dict(self._payload)
+        return self._flat
+
+    def __getitem__(self, key):
+        return self.flat[key]
+
+    def __iter__(self):
+        return iter(self.flat)
+
+    def __len__(self):
+        return len(self.flat)
+
+    def __repr__(self):
+        return repr(self.flat)
+
+
+class GameState():
+    '''Keeps the last known flattened gamestate and dispatches changed paths.
+
+    Subscribers register for a dotted path and are called with
+    (path, old, new) whenever that path, or any path below it, changes. A path
+    that disappears from the payload changes to None. Dispatch only visits the
+    changed paths, so its cost does not grow with the payload size or with the
+    number of subscriptions.
+
+    Only subscribed paths are extracted from the payload and stored, the
+    full payload stays available through the lazily flattened view.
+    '''
+    def __init__(self):
+        self._state = {}
+        self._subscribers = {}
+        self._extractor = None
+        self._payload = {}
+        self._lock = RLock()
+
+    @property
+    def state(self):
+        return self._state
+
+    @property
+    def flat(self):
+        '''The last payload as a lazily flattened view, for debugging.'''
+        return LazyFlatView(self._payload)
+
+    def extract(self, payload):
+        '''Returns the subscribed paths of a nested payload as a flat dict.'''
+        if self._extractor is None:
+            self._extractor = compile_extractor(self._subscribers)
+        return self._extractor(payload)
+
+    def get(self, path, default=None):
+        return self._state.get(path, default)
+
+    def subscribe(self, path, callback):
+        with self._lock:
+            self._subscribers.setdefault(path, []).append(callback)
+            self._extractor = None
+
+    def unsubscribe(self, path, callback):
+        with self._lock:
+            callbacks = self._subscribers.get(path)
+            if callbacks and callback in callbacks:
+                callbacks.remove(callback)
+                if not callbacks:
+                    del self._subscribers[path]
+                    self._extractor = None
+
+    def diff(self, values):
+        '''Returns {path: (old, new)} for every path of a flat dict that differs from the stored state.'''
+        state = self._state
+        changes = {}
+        present = 0
+        for path, value in values.items():
+            if path.split('.', 1)[0] in TRANSIENT:
+                continue
+            if path in state:
+                present += 1
+                old = state[path]
+                if old != value:
+                    changes[path] = (old, value)
+            else:
+                changes[path] = (None, value)
+        if present < len(state):
+            for path, old in state.items():
+                if path not in values:
+                    changes[path] = (old, None)
+        return changes
+
+    def update(self, payload):
+        '''Stores a nested payload, calls the subscribers of changed paths and returns the changes.'''
+        with self._lock:
+            start = time.perf_counter()
+            self._payload = payload
+            changes = self.diff(self.extract(payload))
+            for path, (old, new) in changes.items():
+                if new is None:
+                    self._state.pop(path, None)
+                else:
+                    self._state[path] = new
+            extracted = time.perf_counter()
+            EXTRACT_SECONDS.observe(extracted - start)
+            if self._subscribers and changes:
+                self.dispatch(changes)
+                RULES_SECONDS.observe(time.perf_counter() - extracted)
+        return changes
+
+    def dispatch(self, changes):
+        subscribers = self._subscribers
+        for path, (old, new) in changes.items():
+            prefix = path
+            while True:
+                for callback in subscribers.get(prefix, ()):
+                    try:
+                        callback(path, old, new)
+                    except Exception:
+                        log.exception(f"Gamestate subscriber for {prefix} failed.")
+                end = prefix.rfind('.')
+                if end == -1:
+                    break
+                prefix = prefix[:end]
@@ -1,8 +1,17 @@
-from wled_device import WLEDNetworkDevice
-import logging
-from server import GSIServer
-import toml
 import time
+# Taken before the other imports, startup times include them.
+STARTED = time.monotonic()
+
+from device_group import make_device_group  # noqa: E402
+from wled_device import WLEDNetworkDevice  # noqa: E402
+import logging  # noqa: E402
+import sys  # noqa: E402
+from metrics import MetricsLogger  # noqa: E402
+from players import load_players  # noqa: E402
+from recorder import PayloadRecorder  # noqa: E402
+from rules import DEFAULT_RULES, ConfigWatcher  # noqa: E402
+from server import GSIServer  # noqa: E402
+import toml  # noqa: E402
 
 logging.basicConfig(level=logging.INFO)
 log = logging.getLogger(__name__)
@@ -14,17 +23,67 @@ def get_config():
             config = toml.load(config_file)
     except FileNotFoundError:
         config = {"version": "0.1.0"}
+    if "rules" not in config:
+        config["rules"] = DEFAULT_RULES
         with open("csgo_config.toml", "w") as config_file:
             toml.dump(config, config_file)
     return config
 
+def keep_rules(config, reloaded):
+    '''Copies the rules of a reloaded config into the shared one.
+
+    Devices save the shared config, without this a save would write the old
+    rules back over the edit.
+    '''
+    config["rules"] = reloaded.get("rules", DEFAULT_RULES)
+    for profile in config.get("players", []):
+        edited = next((p for p in reloaded.get("players", []) if p.get("token") == profile.get("token")), {})
+        if "rules" in edited:
+            profile["rules"] = edited["rules"]
+        else:
+            profile.pop("rules", None)
+
 def main():
-    mywled = WLEDNetworkDevice(get_config())
-    server = GSIServer(("127.0.0.1", 3000), "MYTOKENHERE", mywled.handle_csgo_payload)
-    server.start_server()
-    while server.running:
-        time.sleep(1)
-    server.shutdown()
+    config = get_config()
+    # Set record to a file name to keep every payload for replay.py.
+    recorder = PayloadRecorder(config["record"]).start() if config.get("record") else None
+    # Bind to 0.0.0.0 to accept game clients from other machines.
+    host, _, port = config.get("bind", "127.0.0.1:3000").rpartition(":")
+    server = GSIServer((host, int(port)), recorder=recorder)
+    # Payloads that arrive before a device is up are not auth failures.
+    tokens = [profile.get("token") for profile in config.get("players", [])] or [config.get("token", "MYTOKENHERE")]
+    for token in tokens:
+        server.expect_route(token)
+    # Listen right away, routes are added as the devices come up.
+    if not server.start_server():
+        log.error(f"Could not listen on {host}:{port}, is another hutch server running? Set bind in csgo_config.toml to use another address.")
+        sys.exit(1)
+    log.info(f"GSI listener up {(time.monotonic() - STARTED) * 1000:.0f}ms after start")
+    players = load_players(config)
+    if players:
+        for player in players:
+            server.add_route(player.token, player.handle_csgo_payload, player.is_edge)
+
+        def reload_rules(reloaded):
+            keep_rules(config, reloaded)
+            for player in players:
+                player.load_rules(config)
+    else:
+        if config.get("devices"):
+            mywled = make_device_group(config, config["devices"])
+        else:
+            mywled = WLEDNetworkDevice(config)
+        server.add_route(config.get("token", "MYTOKENHERE"), mywled.handle_csgo_payload, mywled.rules.is_edge)
+
+        def reload_rules(reloaded):
+            keep_rules(config, reloaded)
+            mywled.rules.load(config["rules"])
+    log.info(f"Devices set up {(time.monotonic() - STARTED) * 1000:.0f}ms after start")
+    # Rules are hot reloaded, animations that are already playing keep running.
+    ConfigWatcher("csgo_config.toml", reload_rules).start()
+    if config.get("metrics_log_interval"):
+        MetricsLogger(config["metrics_log_interval"]).start()
+    server.serve_forever()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
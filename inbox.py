@@ -0,0 +1,91 @@
+'''Bounded, latest-wins mailbox between the GSI handler and a route's callback.
+
+The game sends the whole gamestate with every POST, so of a run of queued
+payloads only the newest matters, unless one of them is an edge: a payload
+that fires a rule on its own, like a flash onset or a kill. Plain payloads
+are merged into a plain payload still waiting at the tail, edges always keep
+their own entry, so a burst of updates costs one dispatch while no event is
+lost. When the mailbox is full, new payloads are merged into the tail
+whatever they are, the handler never waits.
+'''
+import asyncio
+import logging
+from collections import deque
+
+import metrics
+
+log = logging.getLogger(__name__)
+
+DEPTH = metrics.gauge("hutch_gsi_mailbox_depth", "Payloads waiting for dispatch, over every route.")
+COALESCED = metrics.counter("hutch_gsi_coalesced_total", "Payloads merged into a waiting one instead of dispatched on their own.")
+OVERFLOWED = metrics.counter("hutch_gsi_mailbox_overflow_total", "Payloads merged because the mailbox was full, edges included.")
+
+
+def merge_previously(older, newer):
+    '''Merges two "previously" sections, the older, earliest value of a field wins.'''
+    result = dict(newer)
+    for key, value in older.items():
+        if isinstance(value, dict) and isinstance(result.get(key), dict):
+            result[key] = merge_previously(value, result[key])
+        else:
+            result[key] = value
+    return result
+
+
+def merge_payloads(older, newer):
+    '''Returns newer with the transient sections of both payloads merged.'''
+    for section in ("previously", "added"):
+        if isinstance(older.get(section), dict):
+            newer[section] = merge_previously(older[section], newer.get(section) or {})
+    return newer
+
+
+class Mailbox():
+    '''Entries are [payload, received, edge], received is the perf_counter() of the oldest payload merged in.'''
+    def __init__(self, maxsize=64):
+        self.maxsize = maxsize
+        self._entries = deque()
+        self._event = asyncio.Event()
+        self.received = 0
+        self.coalesced = 0
+        self.overflowed = 0
+        self.max_depth = 0
+
+    @property
+    def depth(self):
+        return len(self._entries)
+
+    def stats(self):
+        return {
+            "depth": self.depth,
+            "max_depth": self.max_depth,
+            "received": self.received,
+            "coalesced": self.coalesced,
+            "overflowed": self.overflowed,
+        }
+
+    def put(self, payload, received, edge=False):
+        self.received += 1
+        tail = self._entries[-1] if self._entries else None
+        if tail is not None and (len(self._entries) >= self.maxsize or not (edge or tail[2])):
+            if len(self._entries) >= self.maxsize:
+                self.overflowed += 1
+                OVERFLOWED.inc()
+            tail[0] = merge_payloads(tail[0], payload)
+            tail[2] = tail[2] or edge
+            self.coalesced += 1
+            COALESCED.inc()
+            return
+        self._entries.append([payload, received, edge])
+        DEPTH.inc()
+        self.max_depth = max(self.max_depth, len(self._entries))
+        self._event.set()
+
+    async def get(self):
+        '''Waits for the oldest entry and returns its (payload, received).'''
+        while not self._entries:
+            self._event.clear()
+            await self._event.wait()
+        payload, received, edge = self._entries.popleft()
+        DEPTH.dec()
+        return payload, received
@@ -0,0 +1,279 @@
+'''Counters, gauges and fixed-bucket latency histograms for every pipeline stage.
+
+Metrics are created once at import time by the modules that record them and
+live in one registry. Recording a sample only bumps preallocated counters
+under a lock, it allocates nothing. The registry renders itself in the
+Prometheus text format for GSIServer's GET /metrics and as a one line
+summary for the log.
+
+Stages are timed with time.perf_counter():
+
+    start = time.perf_counter()
+    ...
+    PARSE_SECONDS.observe(time.perf_counter() - start)
+'''
+import logging
+from bisect import bisect_left
+from threading import Event, Lock, Thread
+
+log = logging.getLogger(__name__)
+
+# Upper bounds in seconds, from 10 microseconds to 2.5 seconds.
+DEFAULT_BUCKETS = (
+    .00001, .000025, .00005, .0001, .00025, .0005,
+    .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5,
+)
+
+
+class Counter():
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self.value = 0
+        self._lock = Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def render(self):
+        return [
+            f"# HELP {self.name} {self.help}",
+            f"# TYPE {self.name} counter",
+            f"{self.name} {self.value}",
+        ]
+
+    def summary(self):
+        return f"{self.name}={self.value}"
+
+
+class Gauge():
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self.value = 0
+        self._lock = Lock()
+
+    def set(self, value):
+        self.value = value
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount=1):
+        with self._lock:
+            self.value -= amount
+
+    def render(self):
+        return [
+            f"# HELP {self.name} {self.help}",
+            f"# TYPE {self.name} gauge",
+            f"{self.name} {self.value}",
+        ]
+
+    def summary(self):
+        return f"{self.name}={self.value}"
+
+
+class GaugeFamily():
+    '''Gauges sharing a name, one per value of a label, e.g. one per device.'''
+    def __init__(self, name, help, label):
+        self.name = name
+        self.help = help
+        self.label = label
+        self._gauges = {}
+        self._lock = Lock()
+
+    def labels(self, value):
+        with self._lock:
+            gauge = self._gauges.get(value)
+            if gauge is None:
+                gauge = self._gauges[value] = Gauge(self.name, self.help)
+            return gauge
+
+    def remove(self, value):
+        with self._lock:
+            self._gauges.pop(value, None)
+
+    def render(self):
+        with self._lock:
+            gauges = sorted(self._gauges.items())
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        for value, gauge in gauges:
+            value = str(value).replace("\\", "\\\\").replace('"', '\\"')
+            lines.append(f'{self.name}{{{self.label}="{value}"}} {gauge.value}')
+        return lines
+
+    def summary(self):
+        with self._lock:
+            gauges = sorted(self._gauges.items())
+        if not gauges:
+            return f"{self.name}=none"
+        return f"{self.name}=" + " ".join(f"{value}:{gauge.value:.4g}" for value, gauge in gauges)
+
+
+class Histogram():
+    '''Counts samples into fixed buckets, the last slot counts samples above every bound.'''
+    def __init__(self, name, help, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self._lock = Lock()
+
+    def observe(self, value):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.sum += value
+            if value > self.max:
+                self.max = value
+
+    def quantile(self, q):
+        '''Estimates a quantile as the upper bound of the bucket it falls in.'''
+        with self._lock:
+            counts = list(self.counts)
+            total = self.count
+            largest = self.max
+        if not total:
+            return None
+        rank = q * total
+        seen = 0
+        for bound, count in zip(self.buckets, counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, largest)
+        return largest
+
+    def render(self):
+        with self._lock:
+            counts = list(self.counts)
+            total = self.count
+            total_sum = self.sum
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        cumulative = 0
+        for bound, count in zip(self.buckets, counts):
+            cumulative += count
+            lines.append(f'{self.name}_bucket{{le="{bound}"}} {cumulative}')
+        lines.append(f'{self.name}_bucket{{le="+Inf"}} {total}')
+        lines.append(f"{self.name}_sum {total_sum}")
+        lines.append(f"{self.name}_count {total}")
+        return lines
+
+    def summary(self):
+        if not self.count:
+            return f"{self.name}=0"
+        p50, p99 = self.quantile(.5), self.quantile(.99)
+        return f"{self.name}={self.count} p50<={p50 * 1e3:.2f}ms p99<={p99 * 1e3:.2f}ms max={self.max * 1e3:.2f}ms"
+
+
+class Registry():
+    '''The metrics by name. Collectors are called before every render or
+    summary, to copy in values that are kept elsewhere, e.g. by another process.
+    '''
+    def __init__(self):
+        self._metrics = {}
+        self._collectors = []
+        self._lock = Lock()
+
+    def add_collector(self, collector):
+        with self._lock:
+            self._collectors.append(collector)
+
+    def remove_collector(self, collector):
+        with self._lock:
+            if collector in self._collectors:
+                self._collectors.remove(collector)
+
+    def collect(self):
+        with self._lock:
+            collectors = list(self._collectors)
+        for collector in collectors:
+            try:
+                collector()
+            except Exception:
+                log.exception("Metrics collector failed.")
+
+    def _get(self, cls, name, help, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, help, **kwargs)
+            return metric
+
+    def counter(self, name, help):
+        return self._get(Counter, name, help)
+
+    def gauge(self, name, help):
+        return self._get(Gauge, name, help)
+
+    def gauge_family(self, name, help, label):
+        return self._get(GaugeFamily, name, help, label=label)
+
+    def histogram(self, name, help, buckets=DEFAULT_BUCKETS):
+        return self._get(Histogram, name, help, buckets=buckets)
+
+    def render(self):
+        '''The Prometheus text exposition of every metric.'''
+        self.collect()
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def summary(self):
+        self.collect()
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return ", ".join(metric.summary() for metric in metrics)
+
+
+REGISTRY = Registry()
+
+
+def counter(name, help):
+    return REGISTRY.counter(name, help)
+
+
+def gauge(name, help):
+    return REGISTRY.gauge(name, help)
+
+
+def gauge_family(name, help, label):
+    return REGISTRY.gauge_family(name, help, label)
+
+
+def histogram(name, help, buckets=DEFAULT_BUCKETS):
+    return REGISTRY.histogram(name, help, buckets)
+
+
+class MetricsLogger():
+    '''Logs a summary of every metric every interval seconds.'''
+    def __init__(self, interval=60, registry=REGISTRY):
+        self.interval = interval
+        self._registry = registry
+        self._stopped = Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = Thread(target=self._run, name="metrics-log", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            log.info(f"Metrics: {self._registry.summary()}")
@@ -0,0 +1,218 @@
+'''Contiguous rgb frame buffers and the effect kernels that draw into them.
+
+A frame is led_count x 3 uint8 values in one block of memory. With NumPy
+installed the buffer is an (N, 3) uint8 array and the kernels are vectorized,
+without it a bytearray is used and the kernels fall back to per-channel
+translation tables or plain loops. Either way, memory exposes the pixels as a
+flat memoryview the protocol encoders copy from directly.
+'''
+import logging
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+log = logging.getLogger(__name__)
+
+
+def linear(t):
+    return t
+
+
+def ease_in(t):
+    return t * t
+
+
+def ease_out(t):
+    return t * (2 - t)
+
+
+def ease_in_out(t):
+    return 2 * t * t if t < .5 else -1 + (4 - 2 * t) * t
+
+
+EASINGS = {
+    "linear": linear,
+    "in": ease_in,
+    "out": ease_out,
+    "in_out": ease_in_out,
+}
+
+
+def mix(start, end, t):
+    '''Interpolates two colors, t runs from 0 (start) to 1 (end).'''
+    return [int(a + (b - a) * t) for a, b in zip(start, end)]
+
+
+class PythonPixelBuffer():
+    '''Frame buffer backed by a bytearray of r, g, b bytes.'''
+    def __init__(self, led_count, data=None):
+        self.led_count = led_count
+        self._data = bytearray(led_count * 3)
+        if data is not None:
+            self._data[:] = data
+
+    @property
+    def memory(self):
+        return memoryview(self._data)
+
+    def __len__(self):
+        return self.led_count
+
+    def __eq__(self, other):
+        if isinstance(other, PythonPixelBuffer):
+            return self._data == other._data
+        return NotImplemented
+
+    def __getitem__(self, index):
+        return list(self._data[index * 3:index * 3 + 3])
+
+    def to_list(self):
+        data = self._data
+        return [list(data[i:i + 3]) for i in range(0, len(data), 3)]
+
+    def copy(self):
+        return type(self)(self.led_count, self._data)
+
+    def fill(self, color):
+        self._data[:] = bytes(color) * self.led_count
+        return self
+
+    def fade(self, start, end, t, easing=linear):
+        '''Fills with the color t of the way from start to end.'''
+        return self.fill(mix(start, end, easing(min(max(t, 0.0), 1.0))))
+
+    def gradient(self, start, end, easing=linear):
+        '''Fills with colors running from start at the first led to end at the last.'''
+        last = max(self.led_count - 1, 1)
+        self._data[:] = b''.join(bytes(mix(start, end, easing(i / last))) for i in range(self.led_count))
+        return self
+
+    def blend_color(self, color, alpha):
+        '''Blends a single color over every pixel.'''
+        if alpha >= 1.0:
+            return self.fill(color)
+        if alpha <= 0.0:
+            return self
+        inverse = 1.0 - alpha
+        for channel in range(3):
+            offset = color[channel] * alpha
+            table = bytes(int(value * inverse + offset) for value in range(256))
+            self._data[channel::3] = self._data[channel::3].translate(table)
+        return self
+
+    def blend(self, other, alpha):
+        '''Blends another buffer of the same size over this one.'''
+        if alpha >= 1.0:
+            self._data[:] = other.memory
+            return self
+        if alpha <= 0.0:
+            return self
+        inverse = 1.0 - alpha
+        self._data[:] = bytes(int(a * inverse + b * alpha) for a, b in zip(self._data, other.memory))
+        return self
+
+    def scale(self, factor):
+        '''Scales brightness by a factor, or by one factor per pixel.'''
+        if isinstance(factor, (int, float)):
+            table = bytes(min(255, int(value * factor)) for value in range(256))
+            self._data[:] = self._data.translate(table)
+            return self
+        data = self._data
+        self._data[:] = bytes(min(255, int(data[i] * factor[i // 3])) for i in range(len(data)))
+        return self
+
+    def resized(self, led_count):
+        '''Returns the frame stretched or shrunk to led_count leds.'''
+        if led_count == self.led_count:
+            return self
+        data = self._data
+        return type(self)(led_count, b''.join(
+            data[(i * self.led_count // led_count) * 3:(i * self.led_count // led_count) * 3 + 3]
+            for i in range(led_count)
+        ))
+
+
+class NumpyPixelBuffer():
+    '''Frame buffer backed by an (N, 3) uint8 NumPy array.'''
+    def __init__(self, led_count, data=None):
+        self.led_count = led_count
+        self.array = numpy.zeros((led_count, 3), dtype=numpy.uint8)
+        self._memory = memoryview(self.array.reshape(-1))
+        if data is not None:
+            self.array.reshape(-1)[:] = numpy.frombuffer(data, dtype=numpy.uint8)
+
+    @property
+    def memory(self):
+        return self._memory
+
+    def __len__(self):
+        return self.led_count
+
+    def __eq__(self, other):
+        if isinstance(other, NumpyPixelBuffer):
+            return numpy.array_equal(self.array, other.array)
+        return NotImplemented
+
+    def __getitem__(self, index):
+        return self.array[index].tolist()
+
+    def to_list(self):
+        return self.array.tolist()
+
+    def copy(self):
+        return type(self)(self.led_count, self.memory)
+
+    def fill(self, color):
+        # Copying the repeated bytes is far cheaper than broadcasting a color list into the array.
+        self.memory[:] = bytes(color) * self.led_count
+        return self
+
+    def fade(self, start, end, t, easing=linear):
+        return self.fill(mix(start, end, easing(min(max(t, 0.0), 1.0))))
+
+    def gradient(self, start, end, easing=linear):
+        t = numpy.linspace(0.0, 1.0, self.led_count)
+        if easing is not linear:
+            t = numpy.vectorize(easing)(t) if self.led_count else t
+        start = numpy.asarray(start, dtype=numpy.float32)
+        end = numpy.asarray(end, dtype=numpy.float32)
+        self.array[:] = start + (end - start) * t[:, None]
+        return self
+
+    def blend_color(self, color, alpha):
+        if alpha >= 1.0:
+            return self.fill(color)
+        if alpha <= 0.0:
+            return self
+        blended = self.array * (1.0 - alpha) + numpy.asarray(color, dtype=numpy.float32) * alpha
+        self.array[:] = blended
+        return self
+
+    def blend(self, other, alpha):
+        if alpha >= 1.0:
+            self.array[:] = other.array
+            return self
+        if alpha <= 0.0:
+            return self
+        self.array[:] = self.array * (1.0 - alpha) + other.array * alpha
+        return self
+
+    def scale(self, factor):
+        if not isinstance(factor, (int, float)):
+            factor = numpy.asarray(factor, dtype=numpy.float32)[:, None]
+        # In float, uint8 * int would wrap around before the clamp.
+        self.array[:] = numpy.minimum(self.array.astype(numpy.float32) * factor, 255)
+        return self
+
+    def resized(self, led_count):
+        if led_count == self.led_count:
+            return self
+        index = numpy.arange(led_count) * self.led_count // led_count
+        resized = type(self)(led_count)
+        resized.array[:] = self.array[index]
+        return resized
+
+
+PixelBuffer = NumpyPixelBuffer if numpy is not None else PythonPixelBuffer
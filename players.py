@@ -0,0 +1,64 @@
+'''Player profiles, for several game clients posting to one hutch server.
+
+Every player in the "players" array of csgo_config.toml has their own GSI
+auth token and devices:
+
+    [[players]]
+    name = "alice"
+    token = "ALICETOKEN"
+    devices = ["wled-alice.local"]
+
+    [[players]]
+    name = "bob"
+    token = "BOBTOKEN"
+    host = "wled-bob.local"
+    fps = 60
+
+"devices" lists hosts or tables like the top-level "devices" array and
+drives them as a group, "host" drives a single device. A player can have
+their own "rules" and "fps", otherwise the top-level ones are used. Every
+player gets their own gamestate, rules and render thread.
+'''
+import logging
+
+from device_group import make_device_group
+from rules import DEFAULT_RULES
+from wled_device import WLEDNetworkDevice
+
+log = logging.getLogger(__name__)
+
+
+class Player():
+    def __init__(self, config, profile):
+        self.token = profile["token"]
+        self.name = profile.get("name", self.token)
+        if profile.get("devices"):
+            self.device = make_device_group(config, profile["devices"], profile.get("fps"))
+        else:
+            self.device = WLEDNetworkDevice(config, host=profile.get("host"), fps=profile.get("fps"))
+        if "rules" in profile:
+            self.device.rules.load(profile["rules"])
+        log.info(f"Player {self.name} is ready.")
+
+    def handle_csgo_payload(self, payload):
+        self.device.handle_csgo_payload(payload)
+
+    def is_edge(self, payload):
+        return self.device.rules.is_edge(payload)
+
+    def load_rules(self, config):
+        '''Reloads the player's rules from a new config, their own if they have some.'''
+        profile = next((p for p in config.get("players", []) if p.get("token") == self.token), {})
+        self.device.rules.load(profile.get("rules", config.get("rules", DEFAULT_RULES)))
+
+    def close(self):
+        self.device.close()
+
+
+def load_players(config):
+    '''Creates a Player for every profile in the config.'''
+    profiles = config.get("players", [])
+    tokens = [profile["token"] for profile in profiles]
+    if len(set(tokens)) != len(tokens):
+        raise ValueError("Every player needs their own token.")
+    return [Player(config, profile) for profile in profiles]
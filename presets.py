@@ -0,0 +1,149 @@
+'''WLED state scenes compiled once, optionally stored on the device as presets.
+
+Scenes are declared with effect and palette names. They are compiled at
+startup into the state dict and the serialized request body that the state
+client sends as is. Names are resolved against the effect and palette lists
+of the device's firmware when they are known, util.effect and util.palette
+otherwise. The lists are fetched once per firmware version and cached in
+the "catalog" table of the config.
+
+With a [presets] table in csgo_config.toml, scenes are also uploaded to the
+device as presets, from slot "first" (default 200) on:
+
+    [presets]
+    upload = true
+    first = 200
+
+A game event then only sends {"ps": slot}. The preset name carries a hash of
+the scene, so presets are only uploaded again when a scene changes.
+'''
+import hashlib
+import json
+import logging
+import urllib.request
+
+from util import effect, palette
+
+log = logging.getLogger(__name__)
+
+SCENES = {
+    "init": {
+        "bri": 40,
+        "on": True,
+        # maybe transition 0? we'll see... Can also use tt instead for a single call.
+        "transition": 0,
+        "seg": [{"bri": 255, "fx": "Solid", "sx": 100, "on": True, "col": [[0, 0, 0]], "tt": 0}],
+    },
+    "idle": {
+        "seg": [{"fx": "Colorloop", "sx": 1, "pal": "Rainbow"}],
+    },
+    "bomb_planted": {
+        "seg": [{"fx": "Breathe", "sx": 200, "col": [[255, 0, 0]], "pal": "Default", "tt": 0}],
+    },
+    "fire": {
+        "seg": [{"fx": "Fire 2012", "sx": 60, "ix": 175, "pal": "Fire", "mi": True, "tt": 0}],
+    },
+}
+
+# Scenes that may be stored as presets. init sets global brightness and is
+# merged with the idle scene on startup, a preset trigger can't be merged.
+PRESET_SCENES = ("idle", "bomb_planted", "fire")
+
+
+def resolve(name, builtin, names, kind):
+    '''Returns the id of an effect or palette name, preferring the device's own list.'''
+    if not isinstance(name, str):
+        return name
+    if names is not None:
+        if name in names:
+            index = names.index(name)
+            if builtin.get(name, index) != index:
+                log.warning(f"The device has {kind} {name} at {index}, util has it at {builtin[name]}.")
+            return index
+        log.warning(f"The device has no {kind} named {name}.")
+    return builtin[name]
+
+
+class Scene():
+    def __init__(self, name, state, effects=None, palettes=None):
+        self.name = name
+        self.state = self.compile(state, effects, palettes)
+        canonical = json.dumps(self.state, sort_keys=True, separators=(',', ':'))
+        self.hash = hashlib.sha1(canonical.encode('utf-8')).hexdigest()[:8]
+        self.preset = None
+        self.patch = self.state
+        # "v" makes WLED answer with its full state, like every state client request.
+        self.body = json.dumps(dict(self.state, v=True)).encode('utf-8')
+
+    def use_preset(self, slot):
+        '''Applies the scene by triggering the preset in slot from now on.'''
+        self.preset = slot
+        self.patch = {"ps": slot}
+        self.body = json.dumps(dict(self.patch, v=True)).encode('utf-8')
+
+    @staticmethod
+    def compile(state, effects, palettes):
+        state = dict(state)
+        if "seg" in state:
+            segments = []
+            for segment in state["seg"]:
+                segment = dict(segment)
+                if "fx" in segment:
+                    segment["fx"] = resolve(segment["fx"], effect, effects, "effect")
+                if "pal" in segment:
+                    segment["pal"] = resolve(segment["pal"], palette, palettes, "palette")
+                segments.append(segment)
+            state["seg"] = segments
+        return state
+
+    @property
+    def preset_name(self):
+        return f"hutch {self.name} {self.hash}"
+
+
+def compile_scenes(scenes=SCENES, effects=None, palettes=None):
+    return {name: Scene(name, state, effects, palettes) for name, state in scenes.items()}
+
+
+def get_json(host, path, timeout=2):
+    with urllib.request.urlopen(f"http://{host}/{path}", timeout=timeout) as response:
+        return json.loads(response.read())
+
+
+def load_catalog(config, host, version, timeout=2):
+    '''Returns the (effects, palettes) names of a firmware version, fetched once per version.'''
+    catalog = config.setdefault("catalog", {})
+    entry = catalog.get(version)
+    if entry is None:
+        entry = {
+            "effects": get_json(host, "json/effects", timeout),
+            "palettes": get_json(host, "json/palettes", timeout),
+        }
+        catalog[version] = entry
+        log.info(f"Cached {len(entry['effects'])} effects and {len(entry['palettes'])} palettes of WLED {version}.")
+    return entry["effects"], entry["palettes"]
+
+
+def sync_presets(host, scenes, first=200, timeout=2):
+    '''Uploads the preset scenes whose preset is missing or holds an older version.
+
+    Returns the number of presets uploaded.
+    '''
+    try:
+        stored = get_json(host, "presets.json", timeout)
+    except Exception:
+        stored = {}
+    uploaded = 0
+    for slot, name in enumerate(PRESET_SCENES, first):
+        scene = scenes[name]
+        if stored.get(str(slot), {}).get("n") != scene.preset_name:
+            # "o" stores the given state as the preset instead of the current one.
+            body = json.dumps(dict(scene.state, psave=slot, n=scene.preset_name, o=True)).encode('utf-8')
+            request = urllib.request.Request(f"http://{host}/json/state", body, {'Content-Type': 'application/json'})
+            with urllib.request.urlopen(request, timeout=timeout):
+                pass
+            uploaded += 1
+        scene.use_preset(slot)
+    if uploaded:
+        log.info(f"Uploaded {uploaded} presets to {host}.")
+    return uploaded
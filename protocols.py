@@ -0,0 +1,318 @@
+'''Frame encoders for the WLED realtime protocols.
+
+Every encoder preallocates its packets (header + pixel payload) once for the
+strip. Encoding a frame only copies pixel data into the payload areas and
+updates per-frame header fields, the packets are handed out as memoryviews
+over those buffers, so they are only valid until the next call to encode().
+'''
+import logging
+import socket
+import uuid
+from itertools import chain
+
+log = logging.getLogger(__name__)
+
+
+def check_option(name, value, low, high, default):
+    '''Returns value if it is an integer from low to high, else logs a config error and returns default.'''
+    if isinstance(value, int) and not isinstance(value, bool) and low <= value <= high:
+        return value
+    log.error(f"Invalid {name} = {value!r} in csgo_config.toml, it must be an integer from {low} to {high}. Using {default}.")
+    return default
+
+
+class FrameEncoder():
+    '''Base class for encoders.
+
+    Subclasses lay out their packets in build() with add_packet(), each packet
+    carries the bytes [start, end) of the frame after its header.
+    '''
+    header = b''
+
+    def __init__(self, led_count):
+        self.led_count = led_count
+        self.frame_size = led_count * 3
+        self._packets = []
+        self._payloads = []
+        self.build()
+        self._packets = tuple(self._packets)
+
+    @property
+    def packets(self):
+        return self._packets
+
+    def build(self):
+        self.add_packet(self.header, 0, self.frame_size)
+
+    def add_packet(self, header, start, end):
+        '''Allocates a packet for frame bytes [start, end) and returns its buffer.'''
+        buffer = bytearray(len(header) + end - start)
+        buffer[:len(header)] = header
+        view = memoryview(buffer)
+        self._packets.append(view)
+        self._payloads.append((view[len(header):], start, end))
+        return buffer
+
+    def frame_bytes(self, data):
+        '''Returns the frame as a bytes-like object of r, g, b bytes.'''
+        if hasattr(data, "memory"):
+            # A PixelBuffer, its memory is used as is.
+            return data.memory
+        if isinstance(data, (bytes, bytearray, memoryview)):
+            return memoryview(data)
+        if len(data) != self.led_count:
+            log.debug(f"Frame has {len(data)} leds, encoder expects {self.led_count}.")
+            data = data[:self.led_count]
+        return memoryview(bytes(chain.from_iterable(data)))
+
+    def fill(self, data):
+        '''Copies a frame into the payload areas of the packets.'''
+        frame = self.frame_bytes(data)
+        size = len(frame)
+        for payload, start, end in self._payloads:
+            if end <= size:
+                payload[:] = frame[start:end]
+            else:
+                length = max(0, size - start)
+                payload[:length] = frame[start:start + length]
+                payload[length:] = bytes(end - start - length)
+
+    def encode(self, data):
+        '''Encodes a frame and returns the packets to send.'''
+        self.fill(data)
+        return self._packets
+
+
+class RealtimeEncoder(FrameEncoder):
+    '''Base for WLED's UDP realtime protocols.
+
+    Header byte 0 selects the protocol, byte 1 is the number of seconds
+    without data before WLED reverts to its own effect, 255 keeps the
+    realtime data until the device gets something else.
+    '''
+    protocol = 0
+    max_leds = None
+
+    def __init__(self, led_count, timeout=1):
+        if self.max_leds is not None and led_count > self.max_leds:
+            raise ValueError(f"{type(self).__name__} can address at most {self.max_leds} leds.")
+        self.timeout = check_option("[realtime] timeout", timeout, 1, 255, 1)
+        super().__init__(led_count)
+
+    @property
+    def header(self):
+        return bytes([self.protocol, self.timeout])
+
+
+class WARLSEncoder(RealtimeEncoder):
+    '''WARLS, every led is sent as its index followed by its color.'''
+    protocol = 1
+    max_leds = 255
+
+    def build(self):
+        self._buffer = bytearray(2 + self.led_count * 4)
+        self._buffer[:2] = self.header
+        self._buffer[2::4] = bytes(range(self.led_count))
+        self._packets.append(memoryview(self._buffer))
+
+    def fill(self, data):
+        frame = bytes(self.frame_bytes(data)[:self.frame_size]).ljust(self.frame_size, b'\x00')
+        for channel in range(3):
+            self._buffer[3 + channel::4] = frame[channel::3]
+
+
+class DRGBEncoder(RealtimeEncoder):
+    '''DRGB, the colors of the whole strip in one datagram.'''
+    protocol = 2
+    max_leds = 490
+
+
+class DNRGBEncoder(RealtimeEncoder):
+    '''DNRGB, the strip split into datagrams of up to 489 leds, each with its start index.'''
+    protocol = 4
+    LEDS_PER_PACKET = 489
+
+    def build(self):
+        for first in range(0, self.led_count, self.LEDS_PER_PACKET):
+            last = min(first + self.LEDS_PER_PACKET, self.led_count)
+            self.add_packet(self.header + first.to_bytes(2, 'big'), first * 3, last * 3)
+
+
+class E131Encoder(FrameEncoder):
+    '''ANSI E1.31 (sACN) data packets, split over as many universes as the strip needs.
+
+    Every universe carries up to 170 rgb pixels (510 DMX slots) and keeps its
+    own sequence number. With a sync_universe the receiver holds the data
+    until the synchronization packet that closes every frame arrives, so all
+    universes update together.
+    '''
+    PIXELS_PER_UNIVERSE = 170
+    HEADER_SIZE = 126
+    SYNC_SIZE = 49
+    SEQUENCE_OFFSET = 111
+    ACN_IDENTIFIER = b'ASC-E1.17\x00\x00\x00'
+    VECTOR_ROOT_E131_DATA = 0x00000004
+    VECTOR_ROOT_E131_EXTENDED = 0x00000008
+    VECTOR_E131_DATA_PACKET = 0x00000002
+    VECTOR_E131_EXTENDED_SYNCHRONIZATION = 0x00000001
+    VECTOR_DMP_SET_PROPERTY = 0x02
+
+    def __init__(self, led_count, universe=1, priority=100, sync_universe=0, source_name="hutch", cid=None):
+        self.universe = check_option("[e131] universe", universe, 1, 63999, 1)
+        self.priority = check_option("[e131] priority", priority, 0, 200, 100)
+        self.sync_universe = check_option("[e131] sync_universe", sync_universe, 0, 63999, 0)
+        self.source_name = source_name
+        self.cid = cid or uuid.uuid5(uuid.NAMESPACE_DNS, f"hutch.{socket.gethostname()}").bytes
+        self.universes = []
+        self._buffers = []
+        self._sync = None
+        super().__init__(led_count)
+
+    def build(self):
+        slots_per_universe = self.PIXELS_PER_UNIVERSE * 3
+        for index, start in enumerate(range(0, self.frame_size, slots_per_universe)):
+            end = min(start + slots_per_universe, self.frame_size)
+            universe = self.universe + index
+            self.universes.append(universe)
+            self._buffers.append(self.add_packet(self.data_header(universe, end - start), start, end))
+        if self.sync_universe:
+            self._sync = bytearray(self.sync_packet())
+            self._packets.append(memoryview(self._sync))
+
+    def data_header(self, universe, slots):
+        length = self.HEADER_SIZE + slots
+        header = bytearray(self.HEADER_SIZE)
+        # Root layer
+        header[0:2] = (0x0010).to_bytes(2, 'big')  # Preamble size
+        header[2:4] = (0x0000).to_bytes(2, 'big')  # Post-amble size
+        header[4:16] = self.ACN_IDENTIFIER
+        header[16:18] = (0x7000 | (length - 16)).to_bytes(2, 'big')
+        header[18:22] = self.VECTOR_ROOT_E131_DATA.to_bytes(4, 'big')
+        header[22:38] = self.cid
+        # Framing layer
+        header[38:40] = (0x7000 | (length - 38)).to_bytes(2, 'big')
+        header[40:44] = self.VECTOR_E131_DATA_PACKET.to_bytes(4, 'big')
+        header[44:108] = self.source_name.encode('utf-8')[:63].ljust(64, b'\x00')
+        header[108] = self.priority
+        header[109:111] = self.sync_universe.to_bytes(2, 'big')
+        header[111] = 0  # Sequence number
+        header[112] = 0  # Options
+        header[113:115] = universe.to_bytes(2, 'big')
+        # DMP layer
+        header[115:117] = (0x7000 | (length - 115)).to_bytes(2, 'big')
+        header[117] = self.VECTOR_DMP_SET_PROPERTY
+        header[118] = 0xa1  # Address and data type
+        header[119:121] = (0x0000).to_bytes(2, 'big')  # First property address
+        header[121:123] = (0x0001).to_bytes(2, 'big')  # Address increment
+        header[123:125] = (slots + 1).to_bytes(2, 'big')  # Property value count, start code included
+        header[125] = 0x00  # DMX start code
+        return header
+
+    def sync_packet(self):
+        packet = bytearray(self.SYNC_SIZE)
+        packet[0:2] = (0x0010).to_bytes(2, 'big')
+        packet[4:16] = self.ACN_IDENTIFIER
+        packet[16:18] = (0x7000 | (self.SYNC_SIZE - 16)).to_bytes(2, 'big')
+        packet[18:22] = self.VECTOR_ROOT_E131_EXTENDED.to_bytes(4, 'big')
+        packet[22:38] = self.cid
+        packet[38:40] = (0x7000 | (self.SYNC_SIZE - 38)).to_bytes(2, 'big')
+        packet[40:44] = self.VECTOR_E131_EXTENDED_SYNCHRONIZATION.to_bytes(4, 'big')
+        packet[44] = 0  # Sequence number
+        packet[45:47] = self.sync_universe.to_bytes(2, 'big')
+        return packet
+
+    @property
+    def destinations(self):
+        '''The universe every packet returned by encode() is addressed to.'''
+        if self._sync is not None:
+            return self.universes + [self.sync_universe]
+        return list(self.universes)
+
+    def encode(self, data):
+        self.fill(data)
+        for buffer in self._buffers:
+            buffer[self.SEQUENCE_OFFSET] = (buffer[self.SEQUENCE_OFFSET] + 1) & 0xff
+        if self._sync is not None:
+            self._sync[44] = (self._sync[44] + 1) & 0xff
+        return self._packets
+
+
+def multicast_address(universe):
+    '''The sACN multicast group of a universe.'''
+    return f"239.255.{universe >> 8}.{universe & 0xff}"
+
+
+class DDPEncoder(FrameEncoder):
+    '''Distributed Display Protocol packets of up to 480 rgb pixels.
+
+    Every packet carries its byte offset into the frame. Only the last packet
+    of a frame has the push flag set, so the device shows the whole frame at
+    once.
+    '''
+    PIXELS_PER_PACKET = 480
+    HEADER_SIZE = 10
+    VERSION_1 = 0x40
+    PUSH = 0x01
+    TYPE_RGB24 = 0x0b
+    ID_DISPLAY = 0x01
+
+    def __init__(self, led_count):
+        self._buffers = []
+        super().__init__(led_count)
+
+    def build(self):
+        chunk = self.PIXELS_PER_PACKET * 3
+        for start in range(0, self.frame_size, chunk):
+            end = min(start + chunk, self.frame_size)
+            flags = self.VERSION_1 | (self.PUSH if end == self.frame_size else 0)
+            header = bytes([flags, 0, self.TYPE_RGB24, self.ID_DISPLAY]) + start.to_bytes(4, 'big') + (end - start).to_bytes(2, 'big')
+            self._buffers.append(self.add_packet(header, start, end))
+
+    def encode(self, data):
+        self.fill(data)
+        # Sequence numbers run from 1 to 15, 0 means unused.
+        sequence = self._buffers[0][1] % 15 + 1 if self._buffers else 0
+        for buffer in self._buffers:
+            buffer[1] = sequence
+        return self._packets
+
+
+class AdalightEncoder(FrameEncoder):
+    def build(self):
+        checksum = (self.led_count >> 8) ^ (self.led_count & 0xff) ^ 0x55
+        header = b'Ada' + self.led_count.to_bytes(2, 'big') + checksum.to_bytes(1, 'big')
+        self.add_packet(header, 0, self.frame_size)
+
+
+ENCODERS = {
+    "warls": WARLSEncoder,
+    "drgb": DRGBEncoder,
+    "dnrgb": DNRGBEncoder,
+    "e131": E131Encoder,
+    "ddp": DDPEncoder,
+    "adalight": AdalightEncoder,
+}
+
+REALTIME_PROTOCOLS = ("warls", "drgb", "dnrgb")
+
+
+def select_realtime_protocol(led_count):
+    '''Picks DRGB while the strip fits in one datagram and DNRGB beyond.
+
+    WARLS is never picked on its own, it needs four bytes per led where DRGB
+    needs three.
+    '''
+    if led_count and led_count > DRGBEncoder.max_leds:
+        return "dnrgb"
+    return "drgb"
+
+
+def select_protocol(led_count):
+    '''Picks the cheapest network protocol for a strip: one DRGB datagram if it fits, else DDP.'''
+    if led_count and led_count > DRGBEncoder.max_leds:
+        return "ddp"
+    return "drgb"
+
+
+def get_encoder(protocol, led_count, **options):
+    return ENCODERS[protocol](led_count, **options)
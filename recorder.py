@@ -0,0 +1,156 @@
+'''Append-only, compressed logs of raw GSI payloads.
+
+Every record is the time.monotonic() the payload arrived at, the length of
+the body and the body exactly as the game sent it:
+
+    <float64 timestamp><uint32 length><body>
+
+The log is a gzip file. Every recording session appends a new gzip member,
+gzip readers treat the concatenation as one stream, so a log can grow over
+several sessions without rewriting it. A member a crashed session left
+without its end marker is closed before the next session appends, otherwise
+everything after it would be unreadable. Timestamps are only comparable within
+a session, replay treats a jump back in time as the start of a new one.
+'''
+import atexit
+import gzip
+import logging
+import os
+import struct
+import zlib
+from queue import SimpleQueue
+from threading import Thread
+import time
+
+log = logging.getLogger(__name__)
+
+RECORD = struct.Struct("<dI")
+
+
+class PayloadRecorder():
+    '''Appends payloads to a log from a writer thread, write() never blocks on disk.'''
+    def __init__(self, filename, compresslevel=6):
+        self.filename = filename
+        self.compresslevel = compresslevel
+        self.recorded = 0
+        self._queue = SimpleQueue()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = Thread(target=self._run, name="gsi-recorder", daemon=True)
+            self._thread.start()
+            # The writer is a daemon thread, close the member even if the program exits on an error.
+            atexit.register(self.close)
+        return self
+
+    def write(self, body, timestamp=None):
+        '''Queues a raw payload body, stamped with the current monotonic time by default.'''
+        if timestamp is None:
+            timestamp = time.monotonic()
+        self._queue.put((timestamp, bytes(body)))
+
+    def close(self):
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+    def repair(self):
+        '''Closes a gzip member a crashed session left open at the end of the log, keeping its whole records.'''
+        if not os.path.exists(self.filename):
+            return
+        found = find_open_member(self.filename)
+        if found is None:
+            return
+        offset, data = found
+        records = whole_records(data)
+        with open(self.filename, "r+b") as log_file:
+            log_file.truncate(offset)
+        with gzip.open(self.filename, "ab", compresslevel=self.compresslevel) as log_file:
+            log_file.write(records)
+        log.warning(f"Closed the session a crash left open in {self.filename}, {len(records)} bytes of records kept.")
+
+    def _run(self):
+        try:
+            self.repair()
+        except (OSError, zlib.error) as e:
+            log.warning(f"Could not check {self.filename} for an unclosed session: {e}")
+        with gzip.open(self.filename, "ab", compresslevel=self.compresslevel) as log_file:
+            while True:
+                record = self._queue.get()
+                if record is None:
+                    break
+                timestamp, body = record
+                log_file.write(RECORD.pack(timestamp, len(body)))
+                log_file.write(body)
+                self.recorded += 1
+                # Push what is buffered to disk while the game is quiet, so a crash loses little.
+                if self._queue.empty():
+                    log_file.flush()
+        log.info(f"Recorded {self.recorded} payloads to {self.filename}")
+
+
+def find_open_member(filename, chunk_size=1 << 16):
+    '''Returns (offset, data) of the last gzip member of a log if it has no end marker, else None.
+
+    data is what could be decompressed of it. A broken member that is not
+    the last one is only logged, the sessions behind it can't be told apart.
+    '''
+    offset = position = 0
+    decompressor = zlib.decompressobj(wbits=31)
+    data = []
+    with open(filename, "rb") as log_file:
+        while True:
+            chunk = log_file.read(chunk_size)
+            if not chunk:
+                break
+            while chunk:
+                try:
+                    data.append(decompressor.decompress(chunk))
+                except zlib.error:
+                    log.warning(f"{filename} has a broken session at byte {offset}, records behind it can't be read.")
+                    return None
+                if not decompressor.eof:
+                    position += len(chunk)
+                    break
+                # The member ended, the rest of the chunk starts the next one.
+                position += len(chunk) - len(decompressor.unused_data)
+                offset = position
+                chunk = decompressor.unused_data
+                decompressor = zlib.decompressobj(wbits=31)
+                data = []
+    if offset == position:
+        return None
+    return offset, b''.join(data)
+
+
+def whole_records(data):
+    '''The leading part of data that holds only complete records.'''
+    end = 0
+    while end + RECORD.size <= len(data):
+        timestamp, length = RECORD.unpack_from(data, end)
+        if end + RECORD.size + length > len(data):
+            break
+        end += RECORD.size + length
+    return data[:end]
+
+
+def read_log(filename):
+    '''Yields (timestamp, body) for every record of a log.'''
+    with gzip.open(filename, "rb") as log_file:
+        while True:
+            try:
+                header = log_file.read(RECORD.size)
+                if len(header) < RECORD.size:
+                    return
+                timestamp, length = RECORD.unpack(header)
+                body = log_file.read(length)
+            except (EOFError, zlib.error):
+                # The recording process died before closing its gzip member, or another was appended behind it.
+                body = b''
+                length = 1
+            if len(body) < length:
+                log.warning(f"{filename} ends with a truncated record.")
+                return
+            yield timestamp, body
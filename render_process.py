@@ -0,0 +1,242 @@
+'''Optional render worker process with a shared-memory frame buffer.
+
+In the default mode the AnimationEngine renders on a thread of the main
+process, where it competes for the GIL with HTTP ingest, payload handling
+and logging. With render_process = true in csgo_config.toml, a
+RenderProcess runs the engine, the frame clock and the frame transport in a
+worker process instead. Animations are sent to it over a queue, they are
+small objects. The frames it renders are published in a SharedMemory block
+so the main process can read them without anything being pickled.
+
+The block starts with a header, followed by the led_count * 3 frame bytes:
+
+    <uint64 sequence><uint64 frames sent><float64 fps><float64 jitter>
+
+The main process copies frames sent, fps and jitter from the header into its
+own metrics registry whenever the metrics are rendered. Render time,
+lateness and send failures are only recorded in the worker's registry.
+
+The sequence is odd while the worker writes a frame, a reader retries
+until it copied a frame with the same even sequence before and after, or
+gives up after READ_ATTEMPTS tries or once the worker is gone.
+'''
+import logging
+import multiprocessing
+import struct
+import time
+from multiprocessing import shared_memory
+from threading import Lock
+
+import metrics
+from animation import FRAMES, AnimationEngine
+from scheduler import FPS, JITTER
+
+log = logging.getLogger(__name__)
+
+HEADER = struct.Struct("<QQdd")
+# Tries of RenderProcess.read() before it gives up on a consistent copy.
+READ_ATTEMPTS = 100
+
+
+def publish(buffer, frame, sent, fps, jitter):
+    sequence = HEADER.unpack_from(buffer)[0] + 1
+    HEADER.pack_into(buffer, 0, sequence, sent, fps, jitter)
+    buffer[HEADER.size:HEADER.size + len(frame)] = frame
+    HEADER.pack_into(buffer, 0, sequence + 1, sent, fps, jitter)
+
+
+class RenderTarget():
+    '''The device as the worker sees it: an encoder, a transport and the shared frame.'''
+    def __init__(self, buffer, target):
+        from protocols import get_encoder
+        from state_client import StateClient
+        from transport import MulticastTransport, UDPTransport
+
+        self._buffer = buffer
+        self.host = target["host"]
+        self.led_count = target["led_count"]
+        self.keepalive = target["keepalive"]
+        self.leds = None
+        self.engine = None
+        self._encoder = get_encoder(target["protocol"], self.led_count, **target["options"])
+        address = target["address"]
+        if isinstance(address[0], tuple):
+            self._transport = MulticastTransport(address).open()
+        else:
+            self._transport = UDPTransport(*address).open()
+        self._state_client = StateClient(self.host, target["timeout"])
+
+    def render(self):
+        self._transport.send(self._encoder.encode(self.leds))
+        scheduler = self.engine.scheduler
+        publish(self._buffer, self.leds.memory, self.engine.sent + 1, scheduler.fps or 0.0, scheduler.jitter)
+
+    def release(self):
+        self._state_client.patch({"live": False})
+
+    def close(self):
+        self._transport.close()
+        self._state_client.close()
+
+
+def run_worker(name, target, framerate, commands):
+    '''Entry point of the worker process.'''
+    # The main process creates and unlinks the block, a spawned worker shares its resource tracker.
+    memory = shared_memory.SharedMemory(name=name)
+    device = RenderTarget(memory.buf, target)
+    engine = device.engine = AnimationEngine(device, framerate)
+    engine.start()
+    try:
+        while True:
+            command, argument = commands.get()
+            if command == "play":
+                engine.play(argument)
+            elif command == "cancel":
+                engine.cancel(argument)
+            elif command == "stop":
+                break
+    except KeyboardInterrupt:
+        pass
+    finally:
+        engine.stop()
+        device.close()
+        del device
+        memory.close()
+
+
+class RenderProcess():
+    '''Stands in for a device's AnimationEngine and runs the real one in a worker process.
+
+    device.render_target() describes what the worker sends frames to. When
+    that changes, e.g. the device reports another led count, retarget()
+    restarts the worker.
+    '''
+    def __init__(self, device, framerate=1/30):
+        self._device = device
+        self._framerate = framerate
+        self._context = multiprocessing.get_context("spawn")
+        self._memory = None
+        self._commands = None
+        self._process = None
+        self._started = False
+        self._lock = Lock()
+        self._collected = 0
+        self.led_count = None
+        self.name = getattr(device, "host", None)
+
+    @property
+    def running(self):
+        return self._process is not None and self._process.is_alive()
+
+    def start(self):
+        with self._lock:
+            self._started = True
+            self._spawn()
+        metrics.REGISTRY.add_collector(self.collect)
+
+    def stop(self):
+        metrics.REGISTRY.remove_collector(self.collect)
+        with self._lock:
+            self._started = False
+            self._join()
+        FPS.remove(self.name)
+        JITTER.remove(self.name)
+
+    def collect(self):
+        '''Copies the worker's frames sent, fps and jitter into this process's registry.'''
+        sequence, sent, fps, jitter, frame = self.read()
+        if not sequence:
+            return
+        FRAMES.inc(max(0, sent - self._collected))
+        self._collected = sent
+        if fps:
+            FPS.labels(self.name).set(fps)
+        JITTER.labels(self.name).set(jitter)
+
+    def retarget(self):
+        '''Restarts the worker for the device's current ip, led count and protocol.
+
+        Animations that were playing in the old worker are dropped.
+        '''
+        with self._lock:
+            if self._started:
+                self._join()
+                self._spawn()
+
+    def _spawn(self):
+        if self._process is not None:
+            return
+        target = self._device.render_target()
+        if not target["led_count"] or target["address"][0] is None:
+            # Started by retarget() once the device's info is known.
+            log.info(f"Render worker for {target['host']} waits for the device's info.")
+            return
+        self.led_count = target["led_count"]
+        self._collected = 0
+        self._memory = shared_memory.SharedMemory(create=True, size=HEADER.size + self.led_count * 3)
+        self._memory.buf[:HEADER.size] = bytes(HEADER.size)
+        self._commands = self._context.Queue()
+        self._process = self._context.Process(
+            target=run_worker,
+            args=(self._memory.name, target, self._framerate, self._commands),
+            name=f"render-{target['host']}",
+            daemon=True,
+        )
+        self._process.start()
+        log.info(f"Render worker {self._process.pid} started for {target['host']}.")
+
+    def _join(self):
+        if self._process is None:
+            return
+        self._commands.put(("stop", None))
+        self._process.join(2)
+        if self._process.is_alive():
+            self._process.terminate()
+            self._process.join()
+        self._process = None
+        self._commands.close()
+        self._commands = None
+        self._memory.close()
+        self._memory.unlink()
+        self._memory = None
+
+    def play(self, animation):
+        '''Queues an animation in the worker, it always reports True.'''
+        with self._lock:
+            if self._commands is not None:
+                self._commands.put(("play", animation))
+        return True
+
+    def cancel(self, key):
+        with self._lock:
+            if self._commands is not None:
+                self._commands.put(("cancel", key))
+
+    def read(self):
+        '''Returns (sequence, sent, fps, jitter, frame bytes) of the last published frame.'''
+        if self._memory is None:
+            return (0, 0, 0.0, 0.0, b'')
+        buffer = self._memory.buf
+        size = self.led_count * 3
+        for attempt in range(READ_ATTEMPTS):
+            sequence = HEADER.unpack_from(buffer)[0]
+            header = HEADER.unpack_from(buffer)
+            frame = bytes(buffer[HEADER.size:HEADER.size + size])
+            if not sequence & 1 and HEADER.unpack_from(buffer)[0] == sequence:
+                return header + (frame,)
+            if not self.running:
+                break
+            time.sleep(0)
+        # The worker died halfway through a frame, or keeps overwriting it, the copy may be torn.
+        log.warning("Could not read a consistent frame from the render worker.")
+        return header + (frame,)
+
+    @property
+    def frame(self):
+        '''A copy of the last frame the worker sent, as a PixelBuffer.'''
+        from pixels import PixelBuffer
+        return PixelBuffer(self.led_count or 0, self.read()[4] or None)
+
+    def stats(self):
+        sequence, sent, fps, jitter, frame = self.read()
+        return {"sent": sent, "fps": fps, "jitter": jitter}
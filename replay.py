@@ -0,0 +1,119 @@
+'''Replays a GSI payload log recorded by GSIServer.
+
+Payloads are either POSTed to a running hutch server, or fed straight into the
+device callback without a server in between. The original timing is kept at
+speed 1, speed 4 replays four times faster and speed 0 as fast as possible.
+
+    python replay.py match.gsi.gz --speed 4
+    python replay.py match.gsi.gz --direct --speed 0
+'''
+import argparse
+import http.client
+import json
+import logging
+import time
+
+from recorder import read_log
+
+log = logging.getLogger(__name__)
+
+
+def replay(records, send, speed=1.0, max_gap=None):
+    '''Calls send(body) for every (timestamp, body) record, paced by the recorded timestamps.
+
+    Gaps longer than max_gap seconds are shortened to max_gap. Returns the
+    number of payloads sent.
+    '''
+    count = 0
+    start = time.monotonic()
+    offset = 0.0
+    previous = None
+    for timestamp, body in records:
+        if previous is not None:
+            # A jump back in time starts a new recording session.
+            gap = max(0.0, timestamp - previous)
+            if max_gap is not None:
+                gap = min(gap, max_gap)
+            offset += gap
+        previous = timestamp
+        if speed:
+            delay = start + offset / speed - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+        send(body)
+        count += 1
+    return count
+
+
+class Poster():
+    '''POSTs payloads over one keep-alive connection, like the game does.'''
+    def __init__(self, host, port, token=None):
+        self._connection = http.client.HTTPConnection(host, port)
+        self.token = token
+        self.failed = 0
+
+    def __call__(self, body):
+        if self.token is not None:
+            payload = json.loads(body)
+            payload["auth"] = {"token": self.token}
+            body = json.dumps(payload)
+        self._connection.request("POST", "/", body, {"Content-Type": "application/json"})
+        response = self._connection.getresponse()
+        response.read()
+        if response.status != 200:
+            self.failed += 1
+
+    def close(self):
+        self._connection.close()
+
+
+def direct_sender(callback):
+    '''Hands payloads to a GSIServer callback the way the server would.'''
+    def send(body):
+        payload = json.loads(body)
+        payload.pop("auth", None)
+        callback(payload)
+    return send
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a recorded GSI payload log.")
+    parser.add_argument("log", help="log file written by the recorder")
+    parser.add_argument("--speed", type=float, default=1, help="replay speed, 0 for as fast as possible")
+    parser.add_argument("--max-gap", type=float, help="shorten pauses longer than this many seconds")
+    parser.add_argument("--host", default="127.0.0.1:3000", help="server to POST to")
+    parser.add_argument("--token", help="replace the recorded auth token")
+    parser.add_argument("--direct", action="store_true", help="feed the configured devices directly instead of POSTing")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    if args.direct:
+        from device_group import make_device_group
+        from hutchserver import get_config
+        from wled_device import WLEDNetworkDevice
+        config = get_config()
+        if config.get("devices"):
+            device = make_device_group(config, config["devices"])
+        else:
+            device = WLEDNetworkDevice(config)
+        send = direct_sender(device.handle_csgo_payload)
+        close = device.close
+    else:
+        host, _, port = args.host.partition(":")
+        send = Poster(host, int(port or 3000), args.token)
+        close = send.close
+
+    start = time.monotonic()
+    try:
+        count = replay(read_log(args.log), send, args.speed, args.max_gap)
+    except KeyboardInterrupt:
+        count = None
+    finally:
+        close()
+    elapsed = time.monotonic() - start
+    if count is not None:
+        log.info(f"Replayed {count} payloads in {elapsed:.2f}s ({count / elapsed if elapsed else 0:.0f}/s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,226 @@
+'''Declarative rules mapping gamestate changes to device animations.
+
+Rules are read from the "rules" array of csgo_config.toml:
+
+    [[rules]]
+    path = "player.state.flashed"
+    when = "increase"
+    animation = "flashbang"
+    params = { start_intensity = "$value", duration = 2 }
+
+"when" is one of:
+    change      any change of the path
+    rising      the value goes from falsy (missing, 0, false) to truthy
+    increase    the value grows, a missing old value counts as 0
+    delta       the value grows by at least "min" (default 1) from a known old value
+    threshold   the value crosses "above" upwards or "below" downwards
+    equals      the value becomes "value"
+
+"animation" names a device method without its a_ prefix, "params" are passed
+to it as keyword arguments. A parameter set to "$value" receives the new
+value of the path.
+'''
+import logging
+import os
+import time
+from threading import Thread
+
+import toml
+
+log = logging.getLogger(__name__)
+
+VALUE = "$value"
+
+DEFAULT_RULES = [
+    {
+        "path": "player.state.flashed",
+        "when": "increase",
+        "animation": "flashbang",
+        "params": {"start_intensity": VALUE, "duration": 2},
+    },
+    {"path": "player.state.burning", "when": "rising", "animation": "fire"},
+    {"path": "player.state.burning", "when": "threshold", "below": 10, "animation": "idle"},
+    {"path": "player.state.round_kills", "when": "delta", "animation": "kill"},
+    {"path": "player.state.round_kills", "when": "equals", "value": 5, "animation": "ace"},
+    {
+        "path": "player.state.round_killhs",
+        "when": "delta",
+        "animation": "blink",
+        "params": {"times": 1, "speed": 1, "color": [255, 153, 0]},
+    },
+    {"path": "player.match_stats.mvps", "when": "delta", "animation": "mvp"},
+    {"path": "round.bomb", "when": "equals", "value": "planted", "animation": "bomb_planted"},
+    {"path": "round.phase", "when": "equals", "value": "live", "animation": "round_start"},
+]
+
+
+def compile_predicate(rule):
+    '''Returns a function (old, new) -> bool for the rule's "when".'''
+    when = rule.get("when", "change")
+    if when == "change":
+        return lambda old, new: True
+    if when == "rising":
+        return lambda old, new: bool(new) and not old
+    if when == "increase":
+        return lambda old, new: new is not None and new > (old or 0)
+    if when == "delta":
+        minimum = rule.get("min", 1)
+        return lambda old, new: old is not None and new is not None and new - old >= minimum
+    if when == "threshold":
+        if "above" in rule:
+            above = rule["above"]
+            return lambda old, new: new is not None and new >= above and (old is None or old < above)
+        if "below" in rule:
+            below = rule["below"]
+            return lambda old, new: new is not None and new < below and (old is None or old >= below)
+        raise ValueError("threshold rules need an 'above' or 'below' value")
+    if when == "equals":
+        value = rule["value"]
+        return lambda old, new: new == value and old != value
+    raise ValueError(f"Unknown rule predicate: {when}")
+
+
+def compile_action(rule, device):
+    '''Returns a function (new) -> None that plays the rule's animation on device.'''
+    name = rule["animation"]
+    method = getattr(device, f"a_{name}", None)
+    if method is None:
+        raise ValueError(f"Unknown animation: {name}")
+    params = dict(rule.get("params", {}))
+    dynamic = [key for key, value in params.items() if value == VALUE]
+    if not dynamic:
+        return lambda new: method(**params)
+
+    def action(new):
+        kwargs = dict(params)
+        for key in dynamic:
+            kwargs[key] = new
+        method(**kwargs)
+    return action
+
+
+def compile_rules(rules, device):
+    '''Compiles rules into a {path: [(predicate, action)]} dispatch table, skipping invalid ones.'''
+    table = {}
+    for rule in rules:
+        try:
+            entry = (compile_predicate(rule), compile_action(rule, device))
+        except (KeyError, ValueError) as e:
+            log.error(f"Skipping rule {rule}: {e}")
+            continue
+        table.setdefault(rule["path"], []).append(entry)
+    return table
+
+
+def lookup(section, keys):
+    '''Walks keys into a nested payload section, returns (value, found).
+
+    A True on the way is how the "added" section marks a whole new subtree.
+    '''
+    value = section
+    for key in keys:
+        if value is True:
+            return None, True
+        if not isinstance(value, dict) or key not in value:
+            return None, False
+        value = value[key]
+    return value, True
+
+
+class RuleEngine():
+    '''Runs compiled rules on the changes of a GameState.'''
+    def __init__(self, device, gamestate, rules=DEFAULT_RULES):
+        self._device = device
+        self._gamestate = gamestate
+        self._table = {}
+        self._keys = {}
+        self._handlers = {}
+        self.load(rules)
+
+    @property
+    def paths(self):
+        return list(self._table)
+
+    def load(self, rules):
+        '''Compiles and swaps in a new rule set, running animations are left alone.'''
+        table = compile_rules(rules, self._device)
+        self._keys = {path: path.split('.') for path in table}
+        self._table = table
+        for path in list(self._handlers):
+            if path not in table:
+                self._gamestate.unsubscribe(path, self._handlers.pop(path))
+        for path in table:
+            if path not in self._handlers:
+                self._handlers[path] = self._make_handler(path)
+                self._gamestate.subscribe(path, self._handlers[path])
+        log.info(f"Loaded {sum(len(entries) for entries in table.values())} rules.")
+
+    def is_edge(self, payload):
+        '''True if a raw GSI payload fires a rule by itself.
+
+        Judged from the old values the game reports in the payload's
+        "previously" and "added" sections, so it needs no gamestate.
+        '''
+        previously = payload.get("previously")
+        added = payload.get("added")
+        if not previously and not added:
+            return False
+        table, paths = self._table, self._keys
+        for path, entries in table.items():
+            keys = paths.get(path) or path.split('.')
+            old, changed = lookup(previously, keys)
+            if not changed:
+                changed = lookup(added, keys)[1]
+            if not changed:
+                continue
+            new = lookup(payload, keys)[0]
+            for predicate, action in entries:
+                try:
+                    if predicate(old, new):
+                        return True
+                except TypeError:
+                    # Values the predicate can't compare, keep the payload to be safe.
+                    return True
+        return False
+
+    def _make_handler(self, path):
+        def handler(changed, old, new):
+            # Prefix subscriptions also fire for paths below the rule's path.
+            if changed != path:
+                return
+            for predicate, action in self._table.get(path, ()):
+                if predicate(old, new):
+                    action(new)
+        return handler
+
+
+class ConfigWatcher(Thread):
+    '''Polls a TOML file and calls callback with its contents whenever it changes.'''
+    def __init__(self, filename, callback, interval=1):
+        super().__init__(name="config-watcher", daemon=True)
+        self._filename = filename
+        self._callback = callback
+        self._interval = interval
+        self._mtime = self._get_mtime()
+        self.stopped = False
+
+    def _get_mtime(self):
+        try:
+            return os.stat(self._filename).st_mtime_ns
+        except OSError:
+            return None
+
+    def run(self):
+        while not self.stopped:
+            time.sleep(self._interval)
+            mtime = self._get_mtime()
+            if mtime == self._mtime:
+                continue
+            self._mtime = mtime
+            try:
+                with open(self._filename, "r") as config_file:
+                    config = toml.load(config_file)
+            except (OSError, toml.TomlDecodeError):
+                log.exception(f"Could not reload {self._filename}.")
+                continue
+            self._callback(config)
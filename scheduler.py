@@ -0,0 +1,98 @@
+'''Frame deadlines on the monotonic clock.'''
+import logging
+
+import metrics
+
+log = logging.getLogger(__name__)
+
+LATENESS_SECONDS = metrics.histogram("hutch_frame_lateness_seconds", "How late frames start after their deadline.")
+SKIPPED = metrics.counter("hutch_frame_deadlines_skipped_total", "Frame deadlines skipped because rendering fell too far behind.")
+FPS = metrics.gauge_family("hutch_frame_rate", "Measured frame rate per device, a moving average.", "device")
+JITTER = metrics.gauge_family("hutch_frame_jitter_seconds", "Moving average of how far frames start from their deadline, per device.", "device")
+
+
+class FrameScheduler():
+    '''Hands out absolute frame deadlines at a target frame rate.
+
+    The next deadline is the previous one plus the frame interval, so time
+    spent rendering and sending does not push later frames back. A late
+    frame is followed right away by the next one, so the schedule catches up.
+    Once it is more than max_lag frames behind, the missed deadlines are
+    skipped instead of rendered in a burst.
+
+    Jitter is a moving average of how far frames start from their deadline,
+    fps a moving average of the measured frame rate. With a name, both are
+    reported as the hutch_frame_rate and hutch_frame_jitter_seconds gauges
+    of that device.
+    '''
+    SMOOTHING = 0.1
+
+    def __init__(self, fps, max_lag=2, name=None):
+        self.interval = 1 / fps
+        self.name = name
+        self.max_lag = max_lag
+        self.deadline = None
+        self.ticks = 0
+        self.skipped = 0
+        self.jitter = 0.0
+        self.max_jitter = 0.0
+        self._period = None
+        self._last_tick = None
+
+    @property
+    def fps(self):
+        return 1 / self._period if self._period else None
+
+    def reset(self, now):
+        '''Starts a new schedule with a deadline at now, after an idle stretch or an early wake up.'''
+        self.deadline = now
+        self._last_tick = None
+
+    def timeout(self, now):
+        '''Seconds until the next deadline.'''
+        if self.deadline is None:
+            return 0
+        return max(0.0, self.deadline - now)
+
+    def tick(self, now):
+        '''Records a frame started at now and returns the next deadline.'''
+        if self.deadline is None:
+            self.deadline = now
+        lateness = abs(now - self.deadline)
+        LATENESS_SECONDS.observe(lateness)
+        self.jitter += (lateness - self.jitter) * self.SMOOTHING
+        self.max_jitter = max(self.max_jitter, lateness)
+        if self._last_tick is not None:
+            period = now - self._last_tick
+            self._period = period if self._period is None else self._period + (period - self._period) * self.SMOOTHING
+        self._last_tick = now
+        self.ticks += 1
+        if self.name is not None:
+            JITTER.labels(self.name).set(self.jitter)
+            if self._period:
+                FPS.labels(self.name).set(self.fps)
+
+        self.deadline += self.interval
+        behind = now - self.deadline
+        if behind > self.max_lag * self.interval:
+            missed = int(behind / self.interval)
+            self.deadline += missed * self.interval
+            self.skipped += missed
+            SKIPPED.inc(missed)
+            log.debug(f"Skipped {missed} frames, rendering is {behind * 1e3:.1f}ms behind.")
+        return self.deadline
+
+    def close(self):
+        '''Drops the device's gauges.'''
+        if self.name is not None:
+            FPS.remove(self.name)
+            JITTER.remove(self.name)
+
+    def stats(self):
+        return {
+            "fps": self.fps,
+            "jitter": self.jitter,
+            "max_jitter": self.max_jitter,
+            "ticks": self.ticks,
+            "skipped": self.skipped,
+        }
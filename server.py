@@ -1,78 +1,257 @@
-from http.server import BaseHTTPRequestHandler, HTTPServer
-from threading import Thread
+from concurrent.futures import ThreadPoolExecutor
+from threading import Event, Thread
+import asyncio
 import json
 import logging
 import time
 
+from aiohttp import web
+
+import metrics
+from inbox import Mailbox
+
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    json_loads = json.loads
+
 log = logging.getLogger(__name__)
 
+PAYLOADS = metrics.counter("hutch_gsi_payloads_total", "Authenticated GSI payloads received.")
+BAD_PAYLOADS = metrics.counter("hutch_gsi_bad_payloads_total", "GSI POSTs that were not valid JSON.")
+AUTH_FAILURES = metrics.counter("hutch_gsi_auth_failures_total", "GSI payloads with a missing or wrong auth token.")
+PENDING = metrics.counter("hutch_gsi_pending_payloads_total", "GSI payloads dropped because their route was still being set up.")
+PARSE_SECONDS = metrics.histogram("hutch_gsi_parse_seconds", "Time to decode a GSI payload.")
+AUTH_SECONDS = metrics.histogram("hutch_gsi_auth_seconds", "Time to authenticate a GSI payload.")
+QUEUE_SECONDS = metrics.histogram("hutch_gsi_queue_seconds", "Time a payload waits before it is dispatched.")
+DISPATCH_SECONDS = metrics.histogram("hutch_gsi_dispatch_seconds", "Time the callback takes to handle a payload.")
 
-def flatten_dict(d):
-    result = {}
-    for key, value in d.items():
-        if isinstance(value, dict):
-            value = flatten_dict(value)
-            for subkey, subvalue in value.items():
-                result[key + '.' + subkey] = subvalue
-        else:
-            result[key] = value
-    return result
 
+class GSIServer():
+    '''Receives CS:GO game state integration POSTs on an asyncio event loop.
 
-class GSIServer(HTTPServer):
-    def __init__(self, server_address, auth_token, callback):
-        super(GSIServer, self).__init__(server_address, RequestHandler)
+    Connections are kept alive between POSTs. Authenticated payloads are
+    passed on as parsed, nested dicts. Every auth token routes to its own
+    callback, so several game clients can post to one server. Each route has
+    its own Mailbox and hands its payloads to its callback in order, a run of
+    payloads that piles up while the callback is busy is merged into the
+    newest one, except for the edges found by the route's is_edge. A
+    coroutine callback is awaited on the event loop, a plain callback runs on
+    a worker thread of its route, so it can never block ingest and a busy
+    route never delays another one. Routes can be added after the server
+    started, so it can listen while devices are still being set up, tokens
+    passed to expect_route() are known meanwhile and their payloads are
+    dropped without counting as auth failures. With a recorder, the raw body
+    of every authenticated payload is also appended to its log. GET /metrics
+    serves the metrics registry in the Prometheus text format.
+    '''
+    def __init__(self, server_address, auth_token=None, callback=None, recorder=None):
+        self.server_address = server_address
         self.auth_token = auth_token
         self.gamestate = None
         self.callback = callback
+        self.recorder = recorder
         self.running = False
+        self.routes = {}
+        self.edges = {}
+        self.pending = set()
         self._thread = None
+        self._loop = None
+        self._runner = None
+        self._queues = {}
+        self._consumers = []
+        self._executors = []
+        self._ready = Event()
+        self._connected = Event()
+        self._stopped = Event()
+        if auth_token is not None:
+            self.add_route(auth_token, callback)
+
+    def add_route(self, auth_token, callback, is_edge=None):
+        '''Routes payloads carrying auth_token to callback, also while the server is running.
+
+        is_edge(payload) tells payloads that must be dispatched on their own,
+        without it every payload may be merged into a newer one.
+        '''
+        self.routes[auth_token] = callback
+        self.edges[auth_token] = is_edge
+        if self._loop is not None and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._open_route, auth_token, callback)
+
+    def expect_route(self, auth_token):
+        '''Marks auth_token as a route that is still being set up.'''
+        self.pending.add(auth_token)
+
+    def make_app(self):
+        app = web.Application()
+        app.router.add_post("/", self.handle_post)
+        app.router.add_get("/metrics", self.handle_metrics)
+        return app
 
-    def start_server(self):
+    def start_server(self, timeout=5):
+        '''Starts the event loop thread and waits until the listener is bound.'''
+        if self._thread is not None:
+            return self._runner is not None
+        log.info("CS:GO GSI Server starting..")
+        self._thread = Thread(target=self._serve, name="gsi-server", daemon=True)
+        self._thread.start()
+        if not self._ready.wait(timeout) or self._runner is None:
+            log.error("Could not start server.")
+            return False
+        log.info(f"CS:GO GSI Server listening on {self.server_address[0]}:{self.server_address[1]}")
+        return True
+
+    def wait_for_game(self, timeout=None):
+        '''Blocks until the first authenticated payload arrives.'''
+        return self._connected.wait(timeout)
+
+    def serve_forever(self):
+        '''Starts the server and blocks until shutdown() or a keyboard interrupt.'''
+        self.start_server()
+        try:
+            # Wake up periodically so a keyboard interrupt is noticed on Windows.
+            while not self._stopped.wait(1):
+                pass
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.shutdown()
+
+    def shutdown(self):
+        if self._loop is not None and self._loop.is_running():
+            self._loop.call_soon_threadsafe(self._loop.stop)
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        for executor in self._executors:
+            executor.shutdown(wait=False)
+        if self.recorder is not None:
+            self.recorder.close()
+        self.running = False
+
+    def _serve(self):
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
         try:
-            self._thread = Thread(target=self.serve_forever)
-            self._thread.start()
-            first_time = True
-            while self.running is False:
-                if first_time is True:
-                    log.info("CS:GO GSI Server starting..")
-                first_time = False
-                # Small sleep to reduce high cpu while waiting on first request to come through.
-                time.sleep(.1)
-        except: # want bare except here so it exits on keyboard interrupt
+            self._loop.run_until_complete(self._start())
+        except Exception:
             log.exception("Could not start server.")
+            self._runner = None
+            self._ready.set()
+            self._stopped.set()
+            return
+        self._ready.set()
+        try:
+            self._loop.run_forever()
+        finally:
+            self._loop.run_until_complete(self._cleanup())
+            self._loop.close()
+            self._stopped.set()
 
+    async def _start(self):
+        for auth_token, callback in list(self.routes.items()):
+            self._open_route(auth_token, callback)
+        runner = web.AppRunner(self.make_app(), access_log=None)
+        await runner.setup()
+        site = web.TCPSite(runner, self.server_address[0], self.server_address[1])
+        await site.start()
+        self._runner = runner
 
-class RequestHandler(BaseHTTPRequestHandler):
-    def do_POST(self):
-        length = int(self.headers["Content-Length"])
-        body = self.rfile.read(length).decode("utf-8")
+    async def _cleanup(self):
+        for consumer in self._consumers:
+            consumer.cancel()
+        if self._runner is not None:
+            await self._runner.cleanup()
 
-        payload = json.loads(body)
-        self.send_response(200, 'OK')
-        self.send_header('Content-type', 'text/html')
-        self.end_headers()
+    def _open_route(self, auth_token, callback):
+        if auth_token in self._queues:
+            return
+        # Every route gets its own worker thread, payloads of one route stay in order.
+        executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="gsi-callback")
+        self._executors.append(executor)
+        self._queues[auth_token] = Mailbox()
+        self._consumers.append(asyncio.create_task(self._consume(self._queues[auth_token], callback, executor)))
 
-        if not self.authenticate_payload(payload):
-            log.warning("auth_token does not match.")
-            return False
+    def mailbox_stats(self):
+        '''Queue depth and coalescing counters of every route's mailbox.'''
+        return {auth_token: mailbox.stats() for auth_token, mailbox in self._queues.items()}
+
+    async def _consume(self, mailbox, callback, executor):
+        while True:
+            payload, received = await mailbox.get()
+            start = time.perf_counter()
+            QUEUE_SECONDS.observe(start - received)
+            try:
+                await self.dispatch(callback, payload, executor)
+            except Exception:
+                log.exception("GSI callback failed.")
+            DISPATCH_SECONDS.observe(time.perf_counter() - start)
+
+    async def dispatch(self, callback, payload, executor=None):
+        '''Hands a payload to a callback without blocking the event loop.'''
+        if asyncio.iscoroutinefunction(callback):
+            await callback(payload)
         else:
-            self.server.running = True
+            await self._loop.run_in_executor(executor, callback, payload)
+
+    async def handle_post(self, request):
+        body = await request.read()
+        start = time.perf_counter()
+        try:
+            payload = json_loads(body)
+        except ValueError:
+            BAD_PAYLOADS.inc()
+            log.warning("Could not decode payload.")
+            return web.Response(status=400)
+        parsed = time.perf_counter()
+        PARSE_SECONDS.observe(parsed - start)
+
+        auth_token = self.route_payload(payload)
+        received = time.perf_counter()
+        AUTH_SECONDS.observe(received - parsed)
+        if auth_token is None:
+            if self.is_pending(payload):
+                PENDING.inc()
+                log.debug("Dropped a payload for a route that is still being set up.")
+                return web.Response(text="OK")
+            AUTH_FAILURES.inc()
+            log.warning("auth_token does not match.")
+            return web.Response(text="OK")
+        PAYLOADS.inc()
+        if self.recorder is not None:
+            self.recorder.write(body)
+        if not self.running:
+            self.running = True
+            self._connected.set()
         del payload["auth"]
-        # if self.server.gamestate:
-            # self.server.callback(old=flatten_dict(self.server.gamestate), new=flatten_dict(payload))
-        # else:
-        self.server.callback(flatten_dict(payload))
-        # self.server.gamestate = (flatten_dict(payload))
+        is_edge = self.edges.get(auth_token)
+        try:
+            edge = is_edge is not None and is_edge(payload)
+        except Exception:
+            log.exception("Could not tell if a payload is an edge.")
+            edge = True
+        self._queues[auth_token].put(payload, received, edge)
+        return web.Response(text="OK")
 
-    def authenticate_payload(self, payload):
-        if "auth" in payload and "token" in payload["auth"]:
-            return payload["auth"]["token"] == self.server.auth_token
-        else:
-            return False
+    async def handle_metrics(self, request):
+        body = metrics.REGISTRY.render().encode('utf-8')
+        return web.Response(body=body, headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
 
-    def log_message(self, format, *args):
-        """
-        Prevents requests from printing into the console
-        """
-        return
+    def route_payload(self, payload):
+        '''Returns the auth token of a payload if it has a route, else None.'''
+        if isinstance(payload, dict) and isinstance(payload.get("auth"), dict):
+            auth_token = payload["auth"].get("token")
+            # Only routes with an open queue, one added while running may not be open yet.
+            if isinstance(auth_token, str) and auth_token in self._queues:
+                return auth_token
+        return None
+
+    def is_pending(self, payload):
+        '''Tells if a payload carries the token of a route that is not open yet.'''
+        if isinstance(payload, dict) and isinstance(payload.get("auth"), dict):
+            auth_token = payload["auth"].get("token")
+            return isinstance(auth_token, str) and (auth_token in self.pending or auth_token in self.routes)
+        return False
+
+    def authenticate_payload(self, payload):
+        return self.route_payload(payload) is not None
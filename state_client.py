@@ -0,0 +1,207 @@
+'''Keep-alive client for the WLED /json/state endpoint.
+
+Patches are queued and merged until the writer thread is free, so a burst of
+state changes costs one request carrying the last value written to every
+field. A shadow copy of the device state, refreshed from every response,
+lets the client drop fields that would not change anything.
+'''
+import http.client
+import json
+import logging
+import time
+from threading import Condition, Thread
+
+import metrics
+
+log = logging.getLogger(__name__)
+
+# Fields the device changes on its own, and commands like a preset trigger, they are always sent.
+VOLATILE = {"live", "ps"}
+
+REQUEST_SECONDS = metrics.histogram("hutch_state_request_seconds", "Round trip of a POST to /json/state.")
+FAILURES = metrics.counter("hutch_state_request_failures_total", "State patches that could not be delivered.")
+
+
+def merge_segments(old, new):
+    '''Merges two "seg" lists, segments are matched by id or by position.'''
+    merged = {}
+    for segments in (old, new):
+        for index, segment in enumerate(segments):
+            key = segment.get("id", index)
+            if key in merged:
+                merge_patch(merged[key], segment)
+            else:
+                merged[key] = dict(segment)
+            merged[key]["id"] = key
+    return list(merged.values())
+
+
+def merge_patch(target, patch):
+    '''Merges patch into target in place, the last writer wins per field.'''
+    for key, value in patch.items():
+        if key == "seg" and isinstance(value, list) and isinstance(target.get(key), list):
+            target[key] = merge_segments(target[key], value)
+        elif isinstance(value, dict) and isinstance(target.get(key), dict):
+            merge_patch(target[key], value)
+        else:
+            target[key] = value
+    return target
+
+
+def prune_patch(patch, shadow):
+    '''Returns the part of patch that differs from shadow.'''
+    result = {}
+    for key, value in patch.items():
+        current = shadow.get(key)
+        if key in VOLATILE:
+            result[key] = value
+        elif key == "seg" and isinstance(value, list) and isinstance(current, list):
+            segments = []
+            for index, segment in enumerate(value):
+                segment_id = segment.get("id", index)
+                known = next((s for s in current if s.get("id") == segment_id), {})
+                changed = prune_patch(segment, known)
+                changed.pop("id", None)
+                if changed:
+                    changed["id"] = segment_id
+                    segments.append(changed)
+            if segments:
+                result[key] = segments
+        elif isinstance(value, dict) and isinstance(current, dict):
+            changed = prune_patch(value, current)
+            if changed:
+                result[key] = changed
+        elif value != current:
+            result[key] = value
+    return result
+
+
+class StateClient():
+    '''Sends merged state patches to one device over a persistent connection.'''
+    def __init__(self, host, timeout=2):
+        self._host = host
+        self._timeout = timeout
+        self._connection = None
+        self._pending = None
+        self._pending_body = None
+        self._enqueued_at = None
+        self._shadow = {}
+        self._condition = Condition()
+        self._running = True
+        self.sent = 0
+        self.merged = 0
+        self.skipped = 0
+        self.failed = 0
+        self.last_latency = None
+        self.max_latency = 0
+        self._total_latency = 0
+        self._thread = Thread(target=self._run, name=f"state-{host}", daemon=True)
+        self._thread.start()
+
+    @property
+    def host(self):
+        return self._host
+
+    @property
+    def shadow(self):
+        return self._shadow
+
+    @property
+    def mean_latency(self):
+        '''Mean seconds from the first queued patch of a request to its response.'''
+        return self._total_latency / self.sent if self.sent else None
+
+    def stats(self):
+        return {
+            "sent": self.sent,
+            "merged": self.merged,
+            "skipped": self.skipped,
+            "failed": self.failed,
+            "last_latency": self.last_latency,
+            "mean_latency": self.mean_latency,
+            "max_latency": self.max_latency,
+        }
+
+    def patch(self, data, body=None):
+        '''Queues a state patch, it is merged with any patch not yet sent.
+
+        body is data already serialized with "v": true, it is sent as is
+        unless the patch gets merged with another one.
+        '''
+        with self._condition:
+            if self._pending is None:
+                self._pending = {}
+                self._pending_body = body
+                self._enqueued_at = time.monotonic()
+            else:
+                self.merged += 1
+                self._pending_body = None
+            merge_patch(self._pending, data)
+            self._condition.notify()
+
+    def close(self):
+        with self._condition:
+            self._running = False
+            self._condition.notify()
+        self._thread.join()
+        if self._connection is not None:
+            self._connection.close()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while self._running and self._pending is None:
+                    self._condition.wait()
+                if not self._running:
+                    break
+                patch = self._pending
+                body = self._pending_body
+                enqueued_at = self._enqueued_at
+                self._pending = None
+            patch = prune_patch(patch, self._shadow)
+            if not patch:
+                self.skipped += 1
+                continue
+            start = time.perf_counter()
+            # A serialized body also carries unchanged fields, sending them does no harm.
+            state = self._post(patch, body)
+            REQUEST_SECONDS.observe(time.perf_counter() - start)
+            if state is None:
+                self.failed += 1
+                FAILURES.inc()
+                continue
+            latency = time.monotonic() - enqueued_at
+            self.sent += 1
+            self.last_latency = latency
+            self.max_latency = max(self.max_latency, latency)
+            self._total_latency += latency
+            self._shadow = state
+
+    def _post(self, patch, body=None):
+        '''Posts a patch, or its serialized body, and returns the device state from the response.'''
+        if body is None:
+            # "v" makes WLED answer with its full state, which refreshes the shadow.
+            body = json.dumps(dict(patch, v=True)).encode('utf-8')
+        for attempt in range(2):
+            try:
+                if self._connection is None:
+                    self._connection = http.client.HTTPConnection(self._host, timeout=self._timeout)
+                self._connection.request("POST", "/json/state", body, {'Content-Type': 'application/json'})
+                response = self._connection.getresponse()
+                data = response.read()
+                if response.status != 200:
+                    log.warning(f"{self._host} answered {response.status} to a state patch.")
+                    return None
+                state = json.loads(data)
+                if not isinstance(state, dict) or "success" in state:
+                    # Older firmware only acknowledges the patch.
+                    state = merge_patch(dict(self._shadow), patch)
+                return state
+            except (OSError, http.client.HTTPException, ValueError) as e:
+                # A kept alive connection may have been closed by the device, retry once on a new one.
+                if self._connection is not None:
+                    self._connection.close()
+                    self._connection = None
+                if attempt:
+                    log.warning(f"Problem sending json data to {self._host}: {e}")
+        return None
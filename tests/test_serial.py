@@ -0,0 +1,187 @@
+'''SerialTransport and WLEDSerialDevice against fake WLED controllers on ptys.'''
+import json
+import os
+import sys
+import time
+from threading import Thread
+from types import SimpleNamespace
+
+import pytest
+
+serial = pytest.importorskip("serial")
+
+from protocols import AdalightEncoder  # noqa: E402
+from transport import SerialTransport  # noqa: E402
+from wled_device import DeviceNotFound, WLEDSerialDevice  # noqa: E402
+
+pytestmark = pytest.mark.skipif(sys.platform == "win32", reason="needs ptys")
+
+INFO_QUERY = b'{"v":true}'
+
+
+class FakeSerialDevice():
+    '''A pty standing in for a controller on a serial port.
+
+    A WLED answers every info query line with its info, a silent device
+    never answers. Adalight frames are recorded, anything else written to
+    the port is kept in garbage.
+    '''
+    def __init__(self, led_count=4, wled=True):
+        self.led_count = led_count
+        self.wled = wled
+        self.queries = 0
+        self.frames = []
+        self.garbage = []
+        self._master, self._slave = os.openpty()
+        self.device = os.ttyname(self._slave)
+        self._thread = Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    @property
+    def port(self):
+        '''What serial.tools.list_ports.comports() lists for the pty.'''
+        return SimpleNamespace(device=self.device)
+
+    @property
+    def info(self):
+        return {"state": {"on": True}, "info": {"ver": "0.14.0", "name": "WLED", "leds": {"count": self.led_count}}}
+
+    def close(self):
+        os.close(self._slave)
+        os.close(self._master)
+
+    def _run(self):
+        buffer = bytearray()
+        while True:
+            try:
+                data = os.read(self._master, 4096)
+            except OSError:
+                return
+            if not data:
+                return
+            buffer += data
+            self._parse(buffer)
+
+    def _parse(self, buffer):
+        while buffer:
+            if buffer.startswith(b"Ada"):
+                if len(buffer) < 6:
+                    return
+                size = 6 + 3 * int.from_bytes(buffer[3:5], "big")
+                if len(buffer) < size:
+                    return
+                self.frames.append(bytes(buffer[6:size]))
+                del buffer[:size]
+            elif b"Ada".startswith(bytes(buffer[:3])):
+                # The start of a frame header, wait for the rest.
+                return
+            elif b"\n" in buffer:
+                line, _, rest = bytes(buffer).partition(b"\n")
+                buffer[:] = rest
+                if line != INFO_QUERY:
+                    self.garbage.append(line)
+                    continue
+                self.queries += 1
+                if self.wled:
+                    os.write(self._master, json.dumps(self.info).encode() + b"\n")
+            else:
+                return
+
+
+@pytest.fixture
+def fakes():
+    devices = []
+
+    def make(**kwargs):
+        device = FakeSerialDevice(**kwargs)
+        devices.append(device)
+        return device
+
+    yield make
+    for device in devices:
+        device.close()
+
+
+def wait_for(predicate, timeout=2):
+    deadline = time.monotonic() + timeout
+    while not predicate() and time.monotonic() < deadline:
+        time.sleep(.01)
+
+
+def list_ports(monkeypatch, devices):
+    monkeypatch.setattr("serial.tools.list_ports.comports", lambda: [device.port for device in devices])
+
+
+def test_ports_are_probed_concurrently(monkeypatch, fakes):
+    silent = [fakes(wled=False) for _ in range(3)]
+    wled = fakes()
+    list_ports(monkeypatch, silent + [wled])
+
+    start = time.monotonic()
+    device = WLEDSerialDevice({}, baud_rate=115200)
+    elapsed = time.monotonic() - start
+    try:
+        # Every silent port waits out the 1s read timeout, one after the other that would take 3s.
+        assert elapsed < 2.5
+        assert device._device.device == wled.device
+        assert device.led_count == wled.led_count
+        assert all(port.queries == 1 for port in silent)
+    finally:
+        device.close()
+
+
+def test_no_wled_on_any_port(monkeypatch, fakes):
+    list_ports(monkeypatch, [fakes(wled=False), fakes(wled=False)])
+    with pytest.raises(DeviceNotFound):
+        WLEDSerialDevice({}, baud_rate=115200)
+
+
+def test_queries_and_frames_share_the_connection(monkeypatch, fakes):
+    wled = fakes()
+    list_ports(monkeypatch, [wled])
+    device = WLEDSerialDevice({}, baud_rate=115200)
+    answers = []
+
+    def query():
+        for _ in range(20):
+            answers.append(json.loads(device.get_serial_info()))
+
+    try:
+        querier = Thread(target=query)
+        querier.start()
+        for value in range(16, 116):
+            device.leds = [[value, value, value]] * device.led_count
+            device.render()
+            time.sleep(.002)
+        querier.join()
+        time.sleep(.2)
+    finally:
+        device.close()
+
+    assert answers == [wled.info] * 20
+    # Queries never end up inside a frame or the other way round.
+    assert wled.garbage == []
+    assert wled.queries == 21
+    assert wled.frames
+    assert all(len(frame) == 3 * wled.led_count for frame in wled.frames)
+    assert wled.frames[-1] == bytes([115]) * 3 * wled.led_count
+
+
+def test_frames_are_dropped_while_the_port_is_busy(fakes):
+    wled = fakes()
+    encoder = AdalightEncoder(wled.led_count)
+    transport = SerialTransport(serial.Serial(wled.device, 115200, timeout=1), max_fps=5)
+    try:
+        transport.send(encoder.encode(bytes([0]) * 3 * wled.led_count))
+        wait_for(lambda: transport.written == 1)
+        for value in range(1, 10):
+            transport.send(encoder.encode(bytes([value]) * 3 * wled.led_count))
+        wait_for(lambda: transport.written == 2)
+        time.sleep(.3)
+    finally:
+        transport.close()
+
+    # At 5 fps only the newest of the nine frames sent after the first one follows it.
+    assert transport.written == 2
+    assert transport.dropped == 8
+    assert wled.frames == [bytes([0]) * 12, bytes([9]) * 12]
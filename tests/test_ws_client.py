@@ -0,0 +1,197 @@
+'''WebSocketStateClient and the device mirror against a local WLED stand-in.'''
+import asyncio
+import json
+import socket
+import time
+from threading import Thread
+
+import pytest
+from aiohttp import WSMsgType, web
+
+from wled_device import WLEDNetworkDevice
+from ws_client import WebSocketStateClient
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_for(predicate, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(.01)
+    return True
+
+
+def reply(document):
+    async def handler(request):
+        return web.json_response(document)
+    return handler
+
+
+class WebSocketWLED():
+    '''Answers /json and /ws like a WLED device, on an event loop thread of its own.
+
+    Every WebSocket client gets {"state", "info"} when it connects and after
+    every state change, like WLED pushes them. The patches clients write are
+    kept in received. stop() and start() restart the server on the same port.
+    '''
+    def __init__(self, led_count=300):
+        self.port = free_port()
+        self.state = {"on": True, "bri": 128}
+        self.info = {"ver": "0.14.0", "name": "WLED", "ip": "127.0.0.1", "uptime": 100, "leds": {"count": led_count}}
+        self.received = []
+        self._sockets = set()
+        self._runner = None
+        self._loop = asyncio.new_event_loop()
+        self._thread = Thread(target=self._loop.run_forever, daemon=True)
+        self._thread.start()
+
+    @property
+    def host(self):
+        return f"127.0.0.1:{self.port}"
+
+    @property
+    def document(self):
+        return {"state": dict(self.state), "info": dict(self.info)}
+
+    def call(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop).result(5)
+
+    def start(self):
+        self.call(self._start())
+        return self
+
+    def stop(self):
+        self.call(self._stop())
+
+    def close(self):
+        self.stop()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+
+    def push(self):
+        self.call(self._broadcast())
+
+    async def _start(self):
+        app = web.Application()
+        app.router.add_get("/json", self.handle_json)
+        app.router.add_get("/json/effects", reply(["Solid"]))
+        app.router.add_get("/json/palettes", reply(["Default"]))
+        app.router.add_get("/presets.json", reply({"0": {}}))
+        app.router.add_get("/ws", self.handle_ws)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, "127.0.0.1", self.port).start()
+
+    async def _stop(self):
+        for ws in list(self._sockets):
+            await ws.close()
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def _broadcast(self):
+        for ws in list(self._sockets):
+            await ws.send_str(json.dumps(self.document))
+
+    async def handle_json(self, request):
+        return web.json_response(self.document)
+
+    async def handle_ws(self, request):
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        self._sockets.add(ws)
+        try:
+            await ws.send_str(json.dumps(self.document))
+            async for message in ws:
+                if message.type != WSMsgType.TEXT:
+                    continue
+                patch = json.loads(message.data)
+                self.received.append(patch)
+                self.state.update(patch)
+                await self._broadcast()
+        finally:
+            self._sockets.discard(ws)
+        return ws
+
+
+@pytest.fixture
+def wled():
+    device = WebSocketWLED().start()
+    yield device
+    device.close()
+
+
+@pytest.fixture
+def client(wled):
+    client = WebSocketStateClient(wled.host, timeout=1)
+    yield client
+    client.close()
+
+
+def test_patches_queued_while_disconnected_are_merged():
+    wled = WebSocketWLED()
+    client = WebSocketStateClient(wled.host, timeout=1)
+    try:
+        client.patch({"bri": 10})
+        client.patch({"bri": 20, "on": False})
+        wled.start()
+        assert client.wait_connected(5)
+        assert wait_for(lambda: wled.received)
+        time.sleep(.1)
+        assert wled.received == [{"bri": 20, "on": False}]
+        assert client.merged == 1
+    finally:
+        client.close()
+        wled.close()
+
+
+def test_unchanged_fields_are_pruned(wled, client):
+    assert client.wait_connected(5)
+    assert wait_for(lambda: client.shadow == wled.state)
+    client.patch({"on": True, "bri": 128})
+    assert wait_for(lambda: client.skipped == 1)
+    client.patch({"on": True, "bri": 50})
+    assert wait_for(lambda: wled.received)
+    assert wled.received == [{"bri": 50}]
+    # The device's push after the change is mirrored.
+    assert wait_for(lambda: client.shadow.get("bri") == 50)
+
+
+def test_reconnects_after_the_server_restarts(wled, client):
+    assert client.wait_connected(5)
+    wled.stop()
+    assert wait_for(lambda: not client.connected)
+    wled.state["bri"] = 1
+    wled.start()
+    assert client.wait_connected(10)
+    assert client.reconnects >= 1
+    # The mirror is filled again on connect.
+    assert wait_for(lambda: client.shadow.get("bri") == 1)
+    client.patch({"bri": 77})
+    assert wait_for(lambda: {"bri": 77} in wled.received)
+
+
+def test_device_mirrors_pushed_info(wled, tmp_path, monkeypatch):
+    # Devices save csgo_config.toml to the working directory.
+    monkeypatch.chdir(tmp_path)
+    device = WLEDNetworkDevice({"state_channel": "websocket"}, host=wled.host, reactions=False)
+    try:
+        assert wait_for(lambda: device.mirror is not None)
+        assert device.led_count == 300
+        assert device.protocol == "drgb"
+
+        wled.info["leds"] = {"count": 600}
+        wled.push()
+        # on_push hands the new info to apply_info, which picks the protocol for it.
+        assert wait_for(lambda: device.led_count == 600)
+        assert device.protocol == "ddp"
+        assert device.mirror["info"]["leds"]["count"] == 600
+        assert device.uptime >= 100
+    finally:
+        device.close()
@@ -0,0 +1,171 @@
+'''Long-lived transports used to push encoded frames to a device.'''
+import logging
+import socket
+import time
+from threading import Condition, Lock, Thread
+
+import metrics
+
+log = logging.getLogger(__name__)
+
+SEND_FAILURES = metrics.counter("hutch_frame_send_failures_total", "Frames that could not be sent or written to a device.")
+DROPPED = metrics.counter("hutch_frames_dropped_total", "Frames replaced by a newer one before they were sent.")
+
+PORTS = {
+    "ddp": 4048,
+    "e131": 5568,
+    "warls": 21324,
+    "drgb": 21324,
+    "dnrgb": 21324,
+}
+
+
+class UDPTransport():
+    '''A connected UDP socket that stays open for the lifetime of a device.'''
+    def __init__(self, host, port):
+        self._address = (host, port)
+        self._sock = None
+
+    @property
+    def address(self):
+        return self._address
+
+    def open(self):
+        if self._sock is None:
+            self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self._sock.connect(self._address)
+        return self
+
+    def send(self, packets):
+        '''Sends every packet as its own datagram.'''
+        if self._sock is None:
+            self.open()
+        try:
+            for packet in packets:
+                self._sock.send(packet)
+        except OSError as e:
+            SEND_FAILURES.inc()
+            log.debug(f"Could not send to {self._address}: {e}")
+            return False
+        return True
+
+    def close(self):
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+
+
+class MulticastTransport():
+    '''Sends every packet of a frame to its own multicast group.'''
+    def __init__(self, addresses, ttl=1):
+        self._addresses = addresses
+        self._ttl = ttl
+        self._sock = None
+
+    @property
+    def address(self):
+        return tuple(self._addresses)
+
+    def open(self):
+        if self._sock is None:
+            self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self._sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, self._ttl)
+        return self
+
+    def send(self, packets):
+        if self._sock is None:
+            self.open()
+        try:
+            for packet, address in zip(packets, self._addresses):
+                self._sock.sendto(packet, address)
+        except OSError as e:
+            SEND_FAILURES.inc()
+            log.debug(f"Could not send to {address}: {e}")
+            return False
+        return True
+
+    def close(self):
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+
+
+def max_serial_fps(baud_rate, packet_size, bits_per_byte=10):
+    '''Highest frame rate a serial link sustains, 8N1 framing sends 10 bits per byte.'''
+    return baud_rate / (packet_size * bits_per_byte)
+
+
+class SerialTransport():
+    '''Writes frames to an open serial port from a writer thread.
+
+    Only the newest frame is kept while the port is busy, older ones are
+    dropped, so a link that is too slow for the frame rate loses frames
+    instead of building up latency. The lock is shared with info queries
+    on the same connection.
+    '''
+    def __init__(self, connection, max_fps):
+        self._connection = connection
+        self._interval = 1 / max_fps
+        self._bytes_per_second = connection.baudrate / 10
+        self._lock = Lock()
+        self._condition = Condition()
+        self._frame = None
+        self._running = True
+        self.written = 0
+        self.dropped = 0
+        self._thread = Thread(target=self._run, name=f"serial-{connection.port}", daemon=True)
+        self._thread.start()
+
+    @property
+    def connection(self):
+        return self._connection
+
+    def send(self, packets):
+        # The packets are views over the encoder's reused buffer, keep a copy.
+        frame = b''.join(packets)
+        with self._condition:
+            if self._frame is not None:
+                self.dropped += 1
+                DROPPED.inc()
+            self._frame = frame
+            self._condition.notify()
+        return True
+
+    def query(self, command):
+        '''Writes a command line and returns the line the device answers with.'''
+        with self._lock:
+            self._connection.write(command)
+            return self._connection.readline().decode()
+
+    def close(self):
+        with self._condition:
+            self._running = False
+            self._condition.notify()
+        self._thread.join()
+        self._connection.close()
+
+    def _run(self):
+        next_write = 0
+        while True:
+            with self._condition:
+                while self._running and self._frame is None:
+                    self._condition.wait()
+                if not self._running:
+                    break
+                frame = self._frame
+                self._frame = None
+            delay = next_write - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            try:
+                with self._lock:
+                    # Let bytes still queued in the driver drain before adding a new frame.
+                    waiting = getattr(self._connection, "out_waiting", 0)
+                    if waiting:
+                        time.sleep(waiting / self._bytes_per_second)
+                    self._connection.write(frame)
+                self.written += 1
+            except Exception as e:
+                SEND_FAILURES.inc()
+                log.debug(f"Could not write to {self._connection.port}: {e}")
+            next_write = time.monotonic() + self._interval
@@ -1,17 +1,30 @@
 import logging
-import serial
-from serial.tools import list_ports
-import time
-import socket
-from zeroconf import ServiceBrowser, ServiceStateChange, Zeroconf
+from concurrent.futures import ThreadPoolExecutor
+from threading import Event, Lock, Thread
 import json
+import time
 import urllib.request
 import toml
-from threading import Thread
-from util import effect, palette
+from animation import AnimationEngine, Blink, Flashbang
+from discovery import DeviceRegistry, discover
+from gamestate import GameState
+from presets import SCENES, compile_scenes, load_catalog, sync_presets
+from protocols import REALTIME_PROTOCOLS, get_encoder, multicast_address, select_protocol, select_realtime_protocol
+from rules import DEFAULT_RULES, RuleEngine
+from state_client import StateClient
+from transport import PORTS, MulticastTransport, SerialTransport, UDPTransport, max_serial_fps
 
 log = logging.getLogger(__name__)
 
+# WLED leaves realtime mode after this many seconds without data unless the
+# protocol carries its own timeout.
+DEVICE_REALTIME_TIMEOUT = 2.5
+# Fraction of the timeout after which an unchanged frame is resent.
+KEEPALIVE_MARGIN = 0.8
+
+# Devices of a group save the shared config from their own threads.
+_save_lock = Lock()
+
 
 class DeviceNotFound(Exception):
     def __str__(self):
@@ -25,6 +38,8 @@ class WLEDDevice():
         self._leds = [[0, 0, 255]]
         self._config = config
         self._previous_device = config.get('previous_device')
+        self._encoders = {}
+        self.led_count = None
         self._colors = {
             "t": [],
             "ct": [],
@@ -79,59 +94,55 @@ class WLEDDevice():
 
     def save(self):
         filename = "csgo_config.toml"
-        with open(filename, "w") as config_file:
+        with _save_lock, open(filename, "w") as config_file:
             toml.dump(self._config, config_file)
 
     def render(self):
         pass
 
+    def release(self):
+        '''Hands the leds back to the device's own effect.'''
+        pass
+
+    @property
+    def keepalive(self):
+        '''Seconds after which an unchanged frame is resent, None if it never has to be.
+
+        Stays just under WLED's default realtime timeout.
+        '''
+        return DEVICE_REALTIME_TIMEOUT * KEEPALIVE_MARGIN
+
+    def get_encoder(self, protocol):
+        '''Returns the cached encoder for a protocol, rebuilt if the led count changed.'''
+        encoder = self._encoders.get(protocol)
+        if encoder is None or encoder.led_count != self.led_count:
+            encoder = get_encoder(protocol, self.led_count, **self.protocol_options(protocol))
+            self._encoders[protocol] = encoder
+        return encoder
+
+    def protocol_options(self, protocol):
+        '''Encoder options for a protocol from its table in the config, e.g. [e131].
+
+        The UDP realtime protocols share the [realtime] table.
+        '''
+        if protocol in REALTIME_PROTOCOLS:
+            protocol = "realtime"
+        options = dict(self._config.get(protocol, {}))
+        options.pop("multicast", None)
+        return options
+
     def make_packet(self, data, protocol):
-        packet = None
-        if data:
-            if protocol == "adalight":
-                if len(data) != self.led_count:
-                    log.warning("Number of leds does not match the data being sent.")
-                    log.info(f"data: {len(data)}, leds: {self.led_count}")
-                payload = bytearray()
-                for color in data:
-                    payload += bytearray(color)
-                checksum = (len(data) >> 8) ^ (len(data) & 0xff) ^ 0x55
-                header = b'Ada' + len(data).to_bytes(2, 'big') + checksum.to_bytes(1, 'big')
-                packet = header + payload
-
-            elif protocol == "e131":
-                # Create the E1.31 packet header
-                header = bytearray([
-                    0x41, 0x53, 0x43, 0x2d, 0x45, 0x31, 0x2e, 0x31,  # "ASC-E1.31"
-                    0x00, 0x00, 0x00, 0x01,  # Universe (4 bytes, big endian)
-                    0x00,  # Sequence number
-                    0x00,  # Options flags
-                    0x00, 0x00  # Length (2 bytes, big endian)
-                ])
-                # Set the length of the packet
-                length = len(data) * 3
-                header[14] = (length >> 8) & 0xff
-                header[15] = length & 0xff
-                # Create the packet payload
-                payload = bytearray()
-                for color in data:
-                    payload += bytearray(color)
-                # Create the packet
-                packet = header + payload
-
-            elif protocol == "warls":
-                # Create the WARLS packet header
-                header = bytearray([
-                    0x02,  # "1 - WARLS, 2 - DRGB"
-                    0x01,  # Revert afer X seconds of no data
-                ])
-                # Create the packet payload
-                payload = bytearray()
-                for color in data:
-                    payload += bytearray(color)
-                # Create the packet
-                packet = header + payload
-        return packet
+        '''Encodes data into the reusable packet buffer of the protocol's encoder.
+
+        The returned packets are views over that buffer and are overwritten by
+        the next call.
+        '''
+        if not data:
+            return None
+        if protocol == "adalight" and len(data) != self.led_count:
+            log.warning("Number of leds does not match the data being sent.")
+            log.info(f"data: {len(data)}, leds: {self.led_count}")
+        return self.get_encoder(protocol).encode(data)
 
     def send_packet(self):
         pass   
@@ -149,7 +160,7 @@ class WLEDDevice():
         host = host or self._device.server
         try:
             # Make a GET request to the device's /json endpoint.
-            with urllib.request.urlopen("http://{}/json".format(host)) as response:
+            with urllib.request.urlopen("http://{}/json".format(host), timeout=2) as response:
                 # If the request is successful (status code 200), return True.
                 if response.getcode() == 200:
                     return True
@@ -161,20 +172,37 @@ class WLEDDevice():
 
 
 class WLEDSerialDevice(WLEDDevice):
-    def __init__(self, config):
+    def __init__(self, config, baud_rate=1500000, fps=None):
         super().__init__(config)
-        self._serial_connection = None
-        self._baud_rate = 1500000
-        self._device = self.get_wled_serial_device()
+        fps = fps or config.get("fps", 30)
+        self._baud_rate = baud_rate
+        self._transport = None
+        self.max_fps = None
+        self._device, self._serial_connection, response = self.get_wled_serial_device()
 
-        response = self.get_serial_info()
         print(response)
         try:
             self._wled = json.loads(response)
-            self._serial_connection = serial.Serial(self._device.device, self._baud_rate)
-            self._leds = [] * self.led_count
+            self.led_count = self._wled.get("info").get("leds").get("count")
+            self._leds = [[0, 0, 0]] * self.led_count
         except Exception:
             log.error("Could not load json from serial.")
+            self._serial_connection.close()
+            raise DeviceNotFound
+        # Adalight frames are a 6 byte header plus 3 bytes per led.
+        self.max_fps = max_serial_fps(self._baud_rate, 6 + 3 * self.led_count)
+        self._framerate = 1 / min(fps, self.max_fps)
+        if fps > self.max_fps:
+            log.warning(f"{self._baud_rate} baud can only carry {self.max_fps:.1f} fps for {self.led_count} leds.")
+        self._transport = SerialTransport(self._serial_connection, self.max_fps)
+
+    @property
+    def framerate(self):
+        return self._framerate
+
+    @property
+    def dropped(self):
+        return self._transport.dropped if self._transport else 0
 
     def render(self):
         self.send_packet(self._leds, "adalight")
@@ -183,207 +211,93 @@ class WLEDSerialDevice(WLEDDevice):
         '''Gets WLED state JSON'''
         self._wled = json.loads(self.get_serial_info())
 
-    def get_serial_info(self, device=None):
-        device = device or self._device
-        with serial.Serial(device.device, self._baud_rate, timeout=1) as ser:
-            # Send a command to the device to get its status.
-            ser.write(b"{\"v\":true}\n")
-            return ser.readline().decode()
+    def get_serial_info(self):
+        # Send a command to the device to get its status.
+        return self._transport.query(b"{\"v\":true}\n")
+
+    def probe_serial_port(self, port):
+        '''Asks a port for WLED info, returns (connection, response) or None.'''
+        # pyserial is only needed for serial devices, it is imported when one is used.
+        import serial
+        try:
+            connection = serial.Serial(port.device, self._baud_rate, timeout=1)
+        except Exception:
+            return None
+        try:
+            connection.write(b"{\"v\":true}\n")
+            response = connection.readline().decode()
+            if "WLED" in response:
+                return connection, response
+        except Exception:
+            pass
+        connection.close()
+        return None
 
     def get_wled_serial_device(self):
-        # Get a list of available serial devices.
+        '''Probes every serial port at once and keeps the first WLED connection open.'''
+        from serial.tools import list_ports
         available_devices = list_ports.comports()
         print(available_devices)
-        # Iterate over the available devices and send a command to check if they are WLED devices.
-        for device in available_devices:
-            try:
-                response = self.get_serial_info(device)
-                # If the device is a WLED device, return its info.
-                print(response)
-                if "WLED" in response:
-                    return device
-            except Exception:
-                # (Handle any exceptions that may occur.)
-                pass
-
-        # If no WLED devices were found, return None.
-        raise DeviceNotFound
+        with ThreadPoolExecutor(max_workers=len(available_devices) or 1) as pool:
+            results = list(pool.map(self.probe_serial_port, available_devices))
+
+        found = None
+        for device, result in zip(available_devices, results):
+            if result is None:
+                continue
+            if found is None:
+                found = (device, *result)
+            else:
+                result[0].close()
+        if found is None:
+            raise DeviceNotFound
+        return found
 
     def send_packet(self, data, protocol):
         packet = self.make_packet(data, protocol)
         if packet:
-            self._serial_connection.write(packet)
-            return True
+            return self._transport.send(packet)
         return False
 
+    def close(self):
+        if self._transport is not None:
+            self._transport.close()
+            self._transport = None
 
-class WLEDNetworkDevice(WLEDDevice):
-    def __init__(self, config):
-        super().__init__(config)
-        self._host = None
-        self._wled = None
-        self._framerate = 1/30
-        self.led_count = None
 
-        self.stop_flag = True
+class GameReactions():
+    '''Game reactions shared by single devices and device groups.
 
-        self.get_device()
-        print(f"Host: {self._host}")
-        self._wled = None
-        if self._host is not None:
-            self._wled = json.loads(self.get_wled_info())
-        self._led = None
-        if self._wled:
-            self.led_count = self._wled.get("info").get("leds").get("count")
+    Expects send_json(), send_scene(), render(), release(), leds and
+    led_count from the class it is mixed into.
+    '''
+    def setup_reactions(self, config, framerate=1/30):
+        if config.get("render_process") and hasattr(self, "render_target"):
+            # Frames are rendered and sent from a worker process, see render_process.
+            from render_process import RenderProcess
+            self.engine = RenderProcess(self, framerate)
+        else:
+            if config.get("render_process"):
+                log.warning(f"render_process only supports single network devices, {type(self).__name__} renders in-thread.")
+            self.engine = AnimationEngine(self, framerate)
+        self.engine.start()
+        self.gamestate = GameState()
+        self.rules = RuleEngine(self, self.gamestate, config.get("rules", DEFAULT_RULES))
+
+    def greet(self):
         self.a_blink(3, 30, [0, 50, 0])
         self.initilize_wled()
         self.a_idle()
 
-    def get_device(self):
-        if self.previous_device:
-            if self.ping_device(self.previous_device):
-                log.info(f'Connected to previously used device: {self.previous_device}')
-                self._host = self.previous_device
-        else:
-            self.get_wled_zeroconf_device()
-
-    def render(self):
-        while not self.stop_flag:
-            self.send_packet(self._leds, "warls")
-            time.sleep(self._framerate)
-
-    def refresh_info(self):
-        '''Gets WLED state JSON'''
-        self._wled = json.loads(self.get_wled_info())
-
-    def get_wled_zeroconf_device(self, timeout=5):
-        devices = []
-
-        def on_service_state_change(zeroconf, service_type, name, state_change):
-            if state_change is ServiceStateChange.Added:
-                info = zeroconf.get_service_info(service_type, name)
-                devices.append(info)
-
-        zc = Zeroconf()
-        ServiceBrowser(zc, "_wled._tcp.local.", handlers=[on_service_state_change])
-
-        try:
-            # Wait for the specified timeout to allow the ServiceBrowser to discover devices
-            socket.setdefaulttimeout(timeout)
-            # start = time.perf_counter()
-            end = time.perf_counter() + timeout
-            log.info(f"Scanning for wled devices for {timeout} seconds...")
-            while time.perf_counter() < end:
-                pass
-        finally:
-            zc.close()
-
-        if devices:
-            for device in devices:
-                log.info(f"Found: {device.server}")
-
-        if len(devices) == 1:
-            self._host = devices[0].server
-        elif len(devices) > 1:
-            print("Multiple WLED devices found:")
-            for i, device in enumerate(devices):
-                stripped_host = None
-                if device.server.endswith('.'):
-                    stripped_host = device.server[:-1]
-                wled = json.loads(self.get_wled_info(stripped_host or device.server))
-                print(f"{i+1}. {wled.get('info').get('name')} {device.server}")
-            selection = input("Enter the number of the device you want to use: ")
-            self._host = devices[int(selection)-1].server
-        else:
-            raise DeviceNotFound
-        if self._host.endswith('.'):
-            self._host = self._host[:-1]
-        self.previous_device = self._host
-
-    def get_wled_info(self, host=None):
-        try:
-            _url = "http://{}/json".format(host or self._host)
-            with urllib.request.urlopen(_url) as response:
-                # If the request is successful (status code 200), return True.
-                if response.getcode() == 200:
-                    data = response.read().decode()
-        except Exception:
-            print("Couldn't get wled info from {}".format(_url))
-        return data
-
-    def send_json(self, data):
-        try:
-            # Set the request headers
-            headers = {'Content-Type': 'application/json'}
-
-            # Encode the data as JSON and set it as the request body
-            req = urllib.request.Request("http://{}/json/state".format(self._host), data=json.dumps(data).encode('utf-8'), headers=headers)
-
-            # Send the request
-            urllib.request.urlopen(req)
-        except Exception:
-            print("Problem sending json data")
-
-    def send_packet(self, data, protocol):
-        packet = self.make_packet(data, protocol)
-        if packet:
-            # Send the packet to the WLED device
-            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-            if protocol == "e131":
-                sock.sendto(packet, (self.ip, 5568))
-            elif protocol == "warls":
-                sock.sendto(packet, (self.ip, 21324))
-            sock.close()
-            return True
-        return False
-
     def handle_csgo_payload(self, payload):
         print(payload)
-        for i in payload:
-            previous = f"previously.{i}"
-            if i == "player.state.flashed":
-                if payload.get(previous) == 0 and payload.get(i) > 0 or payload.get(previous) is None and payload.get(i) > 0:
-                    self.a_flashbang(payload.get(i), duration=2)
-                elif payload.get(previous) is not None and payload.get(i) > payload.get(previous):
-                    self.a_flashbang(payload.get(i), duration=2)
-            if i == "player.state.burning":
-                if payload.get(previous) == 0 and payload.get(i) > 0 or payload.get(previous) is None and payload.get(i) > 0:
-                    self.a_fire()
-                if payload.get(i) < 10:
-                    self.a_idle()
-            if got_hs(payload):
-                self.a_blink(1, 1, [255, 153, 0])
+        self.gamestate.update(payload)
 
     def initilize_wled(self):
-        a = {
-            "bri": 40,
-            "on": True,
-            # maybe transition 0? we'll see... Can also use tt instead for a single call.
-            "transition": 0,
-            "seg": [
-                {
-                    "bri": 255,
-                    "fx": effect['Solid'],
-                    "sx": 100,
-                    "on": True,
-                    "col":[[0, 0, 0]],
-                    "tt": 0
-                }
-            ]
-        }
-        self.send_json(a)
+        self.send_scene("init")
 
     def a_idle(self):
-        a = {
-            "seg": [
-                {
-                    "fx": effect['Colorloop'],
-                    "sx": 1,
-                    "pal": palette['Rainbow']
-                }
-            ]
-        }
-        self.send_json(a)
+        self.send_scene("idle")
 
     def a_ct_idle(sefl):
         pass
@@ -392,37 +306,25 @@ class WLEDNetworkDevice(WLEDDevice):
         pass
 
     def a_round_start(self):
-        pass
+        self.a_idle()
 
     def a_round_end(self):
         pass
 
     def a_bomb_planted(self):
-        pass
+        self.send_scene("bomb_planted")
 
     def a_fire(self):
-        a = {
-            "seg": [
-                {
-                    "fx": effect['Fire 2012'],
-                    "sx": 60,
-                    "ix": 175,
-                    "pal": palette['Fire'],
-                    "mi": True,
-                    "tt": 0
-                }
-            ]
-        }
-        self.send_json(a)
+        self.send_scene("fire")
 
     def a_kill(self):
-        pass
+        self.a_blink(1, 40, [255, 0, 0])
 
     def a_ace(self):
-        pass
+        self.a_blink(5, 30, [255, 215, 0])
 
     def a_mvp(self):
-        pass
+        self.a_blink(3, 20, [255, 215, 0])
 
     def a_win(self):
         pass
@@ -432,19 +334,7 @@ class WLEDNetworkDevice(WLEDDevice):
 
     def a_blink(self, times, speed, color):
         '''Blinks a given number of times'''
-        self.stop_flag = False
-        sleep_time = 10/speed
-        thread = Thread(target=self.render)
-        thread.start()
-        while times != 0:
-            times -= 1
-            self._leds = [[0, 0, 0]] * self.led_count
-            time.sleep(sleep_time)
-            self._leds = [color] * self.led_count
-            time.sleep(sleep_time)
-        self.stop_flag = True
-        thread.join()
-        self.send_json({"live": False})
+        self.engine.play(Blink(times, speed, color))
 
     def a_flashbang(self, start_intensity, duration=.5):
         '''Start a simulated flashbang at the intensity given that lasts for duration.'''
@@ -452,23 +342,315 @@ class WLEDNetworkDevice(WLEDDevice):
         # so this drives the leds manually.
         if start_intensity <= 1:
             return
-        value = start_intensity
-        tick = duration / value
-        self._leds = [[value, value, value]] * self.led_count
-        self.stop_flag = False
-        thread = Thread(target=self.render)
-        thread.start()
-
-        while value > 0:
-            value -= 1
-            self._leds = [[value, value, value]] * self.led_count
-            time.sleep(tick)
-        self.stop_flag = True
-        thread.join()
+        self.engine.play(Flashbang(start_intensity, duration))
+
+
+class WLEDNetworkDevice(GameReactions, WLEDDevice):
+    def __init__(self, config, host=None, protocol="auto", fps=None, reactions=True):
+        '''Connects to host, or finds a device if none is given.
+
+        Devices that are driven as part of a DeviceGroup are created with
+        reactions=False, the group owns the animations and game reactions.
+        protocol "auto" picks DRGB or DDP and "realtime" picks DRGB or DNRGB
+        from the led count the device reports. fps defaults to the "fps" key of
+        the config, or 30.
+
+        When the registry has fresh info for the device, that info is used
+        right away and the device is only validated from a background thread.
+        Otherwise the device is found and asked for its info before the
+        constructor returns. ready is set once the device answered. The
+        scenes are prepared and the device greeted in the background too.
+        '''
+        super().__init__(config)
+        self._host = host
+        self._wled = None
+        self._framerate = 1/(fps or config.get("fps", 30))
+        self._transports = {}
+        self._requested_protocol = protocol
+        self.protocol = protocol
+        self.timeout = 2
+        self._state_client = None
+        self.registry = DeviceRegistry(config)
+        self.ready = Event()
+        self.started = time.monotonic()
+        self.ready_after = None
+        # Compiled against util's tables until the device's own lists are known.
+        self.scenes = compile_scenes(SCENES)
+
+        cached = self.cached_host(host)
+        if cached is not None:
+            self._host = cached
+            entry = self.registry.get(cached)
+            log.info(f"Using cached info for {cached}, validating in the background.")
+            self.apply_info({"info": {"name": entry["name"], "ip": entry["ip"], "ver": entry["ver"], "leds": {"count": entry["leds"]}}})
+        else:
+            if self._host is None:
+                self.get_device()
+            info = self.get_wled_info() if self._host is not None else None
+            if info is not None:
+                self.apply_info(json.loads(info))
+                self.registry.update(self._host, self._wled)
+                # Cache the info for the next start.
+                self.save()
+                self.ready_after = time.monotonic() - self.started
+                self.ready.set()
+            else:
+                self.apply_info(None)
+        print(f"Host: {self._host}")
+        if reactions:
+            self.setup_reactions(config, self._framerate)
+        Thread(target=self.bring_up, args=(host is None, reactions), name=f"bring-up-{self._host}", daemon=True).start()
+
+    def bring_up(self, rediscover=True, greet=True):
+        '''Validates cached info and prepares the scenes, then greets.'''
+        if not self.ready.is_set() and not self.validate(rediscover):
+            return
+        # Opens the WebSocket channel early, its mirror is filled on connect.
+        self.state_client
+        try:
+            self.prepare_scenes()
+        except Exception as e:
+            log.warning(f"Could not prepare scenes on {self._host}: {e}")
+        if greet:
+            self.greet()
+
+    def prepare_scenes(self):
+        '''Compiles the scenes against the device's effect lists and syncs them as presets if enabled.'''
+        version = self._wled.get("info", {}).get("ver")
+        if not version:
+            return
+        effects, palettes = load_catalog(self._config, self._host, version, self.timeout)
+        scenes = compile_scenes(SCENES, effects, palettes)
+        presets = self._config.get("presets", {})
+        if presets.get("upload"):
+            sync_presets(self._host, scenes, presets.get("first", 200), self.timeout)
+        self.scenes = scenes
+        self.save()
+
+    def cached_host(self, host=None):
+        '''Returns host, or the previously used device, if the registry has fresh info for it.'''
+        host = host or self.previous_device
+        if host is not None and self.registry.get(host) is not None:
+            return host
+        return None
+
+    def apply_info(self, wled):
+        '''Takes the led count from a /json document and picks the protocol for it.'''
+        target = (self.ip, self.led_count, self.protocol)
+        self._wled = wled
+        if wled:
+            self.led_count = wled.get("info").get("leds").get("count")
+        protocol = self._requested_protocol
+        if protocol == "auto":
+            protocol = select_protocol(self.led_count)
+        elif protocol == "realtime":
+            protocol = select_realtime_protocol(self.led_count)
+        if protocol != self.protocol and protocol != self._requested_protocol:
+            log.info(f"Using {protocol} for {self.led_count} leds.")
+        self.protocol = protocol
+        engine = getattr(self, "engine", None)
+        if hasattr(engine, "retarget") and (self.ip, self.led_count, self.protocol) != target:
+            engine.retarget()
+
+    def validate(self, rediscover=True):
+        '''Checks cached info against the device, finding it again if it moved.
+
+        Returns True once the device answered.
+        '''
+        info = self.get_wled_info()
+        if info is None and rediscover:
+            log.warning(f"{self._host} did not answer, looking for the device again.")
+            self.registry.forget(self._host)
+            self._host = None
+            try:
+                self.get_device()
+            except DeviceNotFound:
+                log.error("Could not find a WLED device.")
+                return False
+            info = self.get_wled_info()
+        if info is None:
+            log.warning(f"Could not validate {self._host}, keeping its cached info.")
+            return False
+        wled = json.loads(info)
+        if wled.get("info", {}).get("leds", {}).get("count") != self.led_count:
+            log.info(f"{self._host} has {wled['info']['leds']['count']} leds now.")
+        self.apply_info(wled)
+        self.registry.update(self._host, wled)
+        self.save()
+        self.ready_after = time.monotonic() - self.started
+        self.ready.set()
+        log.info(f"{self._host} ready after {self.ready_after * 1000:.0f}ms")
+        return True
+
+    @property
+    def host(self):
+        return self._host
+
+    @property
+    def framerate(self):
+        return self._framerate
+
+    def get_device(self):
+        if self.previous_device and self.ping_device(self.previous_device):
+            log.info(f'Connected to previously used device: {self.previous_device}')
+            self._host = self.previous_device
+            return
+        host, wled = self.registry.find_reachable(self.timeout)
+        if host is not None:
+            log.info(f'Connected to known device: {host}')
+            self._host = host
+            self.previous_device = host
+            return
+        self.get_wled_zeroconf_device()
+
+    def render(self):
+        self.send_packet(self._leds, self.protocol)
+
+    def release(self):
         self.send_json({"live": False})
 
-def got_hs(payload):
-    if payload.get("previously.player.state.round_killhs") is not None and payload.get("player.state.round_killhs") is not None:
-        if payload.get("previously.player.state.round_killhs") < payload.get("player.state.round_killhs"):
-            return True
-    return False
\ No newline at end of file
+    @property
+    def keepalive(self):
+        if self.protocol in REALTIME_PROTOCOLS:
+            # The encoder holds the checked timeout.
+            timeout = self.get_encoder(self.protocol).timeout if self.led_count else 1
+            if timeout == 255:
+                # 255 keeps realtime mode until the device gets something else.
+                return None
+            return timeout * KEEPALIVE_MARGIN
+        return super().keepalive
+
+    def refresh_info(self):
+        '''Gets WLED state JSON, from the WebSocket mirror when it is connected.'''
+        mirror = self.mirror
+        if mirror is not None:
+            self._wled = mirror
+            return
+        self._wled = json.loads(self.get_wled_info())
+
+    @property
+    def mirror(self):
+        '''The {"state", "info"} pushed over the WebSocket channel, None unless it is connected.'''
+        client = self._state_client
+        if getattr(client, "connected", False) and client.info:
+            return {"state": client.shadow, "info": client.info}
+        return None
+
+    @property
+    def uptime(self):
+        client = self._state_client
+        if self.mirror is not None and client.uptime is not None:
+            return client.uptime
+        return super().uptime
+
+    def on_push(self, document):
+        '''Keeps ip, led count and protocol current from the device's pushes.'''
+        if isinstance(document.get("info"), dict) and document["info"].get("leds"):
+            self.apply_info({"state": document.get("state", {}), "info": document["info"]})
+
+    def get_wled_zeroconf_device(self, timeout=5):
+        devices = discover(timeout, count=self.config.get("expected_devices"), probe_timeout=self.timeout)
+        for host, wled in devices.items():
+            self.registry.update(host, wled)
+
+        hosts = list(devices)
+        if len(hosts) == 1:
+            self._host = hosts[0]
+        elif len(hosts) > 1:
+            print("Multiple WLED devices found:")
+            for i, host in enumerate(hosts):
+                print(f"{i+1}. {devices[host].get('info').get('name')} {host}")
+            selection = input("Enter the number of the device you want to use: ")
+            self._host = hosts[int(selection)-1]
+        else:
+            raise DeviceNotFound
+        self.previous_device = self._host
+
+    def get_wled_info(self, host=None):
+        data = None
+        try:
+            _url = "http://{}/json".format(host or self._host)
+            with urllib.request.urlopen(_url, timeout=self.timeout) as response:
+                # If the request is successful (status code 200), return True.
+                if response.getcode() == 200:
+                    data = response.read().decode()
+        except Exception:
+            print("Couldn't get wled info from {}".format(_url))
+        return data
+
+    @property
+    def state_client(self):
+        '''The state channel, recreated if the host changed.
+
+        The keep-alive /json/state client by default, the /ws WebSocket with
+        state_channel = "websocket" in the config.
+        '''
+        if self._state_client is None or self._state_client.host != self._host:
+            if self._state_client is not None:
+                self._state_client.close()
+            if self._config.get("state_channel") == "websocket":
+                from ws_client import WebSocketStateClient
+                self._state_client = WebSocketStateClient(self._host, self.timeout, self.on_push)
+            else:
+                self._state_client = StateClient(self._host, self.timeout)
+        return self._state_client
+
+    def send_json(self, data):
+        '''Queues a state patch, patches queued while a request is in flight are merged.'''
+        self.state_client.patch(data)
+
+    def send_scene(self, name):
+        '''Applies a compiled scene, with its cached request body.'''
+        scene = self.scenes[name]
+        self.state_client.patch(scene.patch, scene.body)
+
+    def transport_address(self, protocol):
+        '''The (host, port) frames of a protocol go to, or one per universe for multicast E1.31.'''
+        if protocol == "e131" and self._config.get("e131", {}).get("multicast"):
+            encoder = self.get_encoder(protocol)
+            return tuple((multicast_address(universe), PORTS[protocol]) for universe in encoder.destinations)
+        return (self.ip, PORTS[protocol])
+
+    def render_target(self):
+        '''What a render worker process needs to send this device's frames itself.'''
+        return {
+            "host": self._host,
+            "led_count": self.led_count,
+            "protocol": self.protocol,
+            "options": self.protocol_options(self.protocol),
+            "address": self.transport_address(self.protocol),
+            "keepalive": self.keepalive,
+            "timeout": self.timeout,
+        }
+
+    def get_transport(self, protocol):
+        '''Returns the open transport for a protocol, reconnecting if the device ip changed.'''
+        address = self.transport_address(protocol)
+        transport = self._transports.get(protocol)
+        if transport is None or transport.address != address:
+            if transport is not None:
+                transport.close()
+            if isinstance(address[0], tuple):
+                transport = MulticastTransport(address).open()
+            else:
+                transport = UDPTransport(*address).open()
+            self._transports[protocol] = transport
+        return transport
+
+    def close(self):
+        engine = getattr(self, "engine", None)
+        if engine is not None:
+            engine.stop()
+        for transport in self._transports.values():
+            transport.close()
+        self._transports.clear()
+        if self._state_client is not None:
+            self._state_client.close()
+            self._state_client = None
+
+    def send_packet(self, data, protocol):
+        packets = self.make_packet(data, protocol)
+        if packets:
+            # Send the packet to the WLED device
+            return self.get_transport(protocol).send(packets)
+        return False
@@ -0,0 +1,192 @@
+'''WLED state over the /ws WebSocket, with a live mirror of the device.
+
+WLED pushes {"state": ..., "info": ...} to every WebSocket client when one
+connects and after every state change, so the mirror stays current without
+polling. Patches are queued and merged like with the HTTP StateClient and
+written over the one persistent connection, which is reopened with backoff
+whenever it drops.
+'''
+import asyncio
+import json
+import logging
+import time
+from threading import Event, Lock, Thread
+
+import aiohttp
+
+from state_client import merge_patch, prune_patch
+
+log = logging.getLogger(__name__)
+
+
+class WebSocketStateClient():
+    '''Drop-in for StateClient that writes patches to /ws and mirrors what the device pushes.
+
+    on_info(document) is called from the client's thread with every pushed
+    {"state", "info"} document.
+    '''
+    MAX_BACKOFF = 5
+
+    def __init__(self, host, timeout=2, on_info=None):
+        self._host = host
+        self._timeout = timeout
+        self._on_info = on_info
+        self._lock = Lock()
+        self._pending = None
+        self._shadow = {}
+        self._info = {}
+        self._info_at = None
+        self._connected = Event()
+        self._running = True
+        self._loop = asyncio.new_event_loop()
+        self._wake = asyncio.Event()
+        self._task = None
+        self.sent = 0
+        self.merged = 0
+        self.skipped = 0
+        self.failed = 0
+        self.pushes = 0
+        self.reconnects = 0
+        self._thread = Thread(target=self._run, name=f"ws-{host}", daemon=True)
+        self._thread.start()
+
+    @property
+    def host(self):
+        return self._host
+
+    @property
+    def shadow(self):
+        return self._shadow
+
+    @property
+    def info(self):
+        return self._info
+
+    @property
+    def connected(self):
+        return self._connected.is_set()
+
+    @property
+    def uptime(self):
+        '''Device uptime in seconds, advanced from the last push by the local clock.'''
+        if self._info_at is None or "uptime" not in self._info:
+            return None
+        return self._info["uptime"] + int(time.monotonic() - self._info_at)
+
+    def wait_connected(self, timeout=None):
+        return self._connected.wait(timeout)
+
+    def stats(self):
+        return {
+            "sent": self.sent,
+            "merged": self.merged,
+            "skipped": self.skipped,
+            "failed": self.failed,
+            "pushes": self.pushes,
+            "reconnects": self.reconnects,
+            "connected": self.connected,
+        }
+
+    def patch(self, data, body=None):
+        '''Queues a state patch, it is merged with any patch not yet written.
+
+        body is accepted for compatibility with StateClient, the merged patch
+        is always what gets written.
+        '''
+        with self._lock:
+            if self._pending is None:
+                self._pending = {}
+            else:
+                self.merged += 1
+            merge_patch(self._pending, data)
+        self._loop.call_soon_threadsafe(self._wake.set)
+
+    def close(self):
+        self._running = False
+        if self._task is not None and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._task.cancel)
+        self._thread.join()
+
+    def _run(self):
+        asyncio.set_event_loop(self._loop)
+        self._task = self._loop.create_task(self._main())
+        try:
+            self._loop.run_until_complete(self._task)
+        except asyncio.CancelledError:
+            pass
+        finally:
+            self._loop.close()
+
+    async def _main(self):
+        backoff = .5
+        timeout = aiohttp.ClientTimeout(total=None, connect=self._timeout)
+        async with aiohttp.ClientSession(timeout=timeout) as session:
+            while self._running:
+                try:
+                    async with session.ws_connect(f"http://{self._host}/ws", heartbeat=10) as ws:
+                        self._connected.set()
+                        backoff = .5
+                        reader = asyncio.create_task(self._read(ws))
+                        try:
+                            await self._write(ws)
+                        finally:
+                            reader.cancel()
+                except (aiohttp.ClientError, asyncio.TimeoutError, OSError) as e:
+                    log.debug(f"WebSocket to {self._host} failed: {e}")
+                self._connected.clear()
+                if self._running:
+                    self.reconnects += 1
+                    await asyncio.sleep(backoff)
+                    backoff = min(backoff * 2, self.MAX_BACKOFF)
+
+    async def _write(self, ws):
+        # Anything queued while disconnected goes out as soon as the socket is open.
+        self._wake.set()
+        while not ws.closed:
+            await self._wake.wait()
+            self._wake.clear()
+            with self._lock:
+                patch = self._pending
+                self._pending = None
+            if patch is None:
+                continue
+            changed = prune_patch(patch, self._shadow)
+            if not changed:
+                self.skipped += 1
+                continue
+            try:
+                await ws.send_str(json.dumps(changed))
+                self.sent += 1
+            except (ConnectionError, RuntimeError) as e:
+                self.failed += 1
+                # Put the patch back under anything queued since, it is written after reconnecting.
+                with self._lock:
+                    self._pending = merge_patch(patch, self._pending or {})
+                log.debug(f"Could not write to {self._host}: {e}")
+                return
+
+    async def _read(self, ws):
+        try:
+            async for message in ws:
+                if message.type != aiohttp.WSMsgType.TEXT:
+                    continue
+                try:
+                    document = json.loads(message.data)
+                except ValueError:
+                    continue
+                if not isinstance(document, dict):
+                    continue
+                self.pushes += 1
+                if isinstance(document.get("state"), dict):
+                    self._shadow = document["state"]
+                if isinstance(document.get("info"), dict):
+                    self._info = document["info"]
+                    self._info_at = time.monotonic()
+                if self._on_info is not None:
+                    try:
+                        self._on_info(document)
+                    except Exception:
+                        log.exception(f"Handling a push from {self._host} failed.")
+        finally:
+            # Wake the writer so it notices the socket closed.
+            self._wake.set()